@@ -0,0 +1,130 @@
+import os
+import sys
+import csv
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from engine import GLOBAL_SETTINGS, parse_workbook, patch_export, export_with_openpyxl, UnsupportedLayout
+
+# Headless batch costing: python batch.py invoices/ extra.xlsx -o costed/
+# Uses the same header detection, formula and export as the app, without Kivy.
+
+CSV_FIELDS = ["sheet", "row_index", "name", "rmb_price", "qty", "unit_cost", "total_line"]
+SUMMARY_FIELDS = ["file", "status", "header_row", "sheets", "lines", "total_investment", "outputs", "seconds"]
+OUTPUT_SUFFIX = "_costed"
+
+def is_output_name(name):
+    """ <name>_costed.xlsx or <name>_costed_<n>.xlsx, as output_stems names them. """
+    stem = os.path.splitext(name)[0]
+    return stem.endswith(OUTPUT_SUFFIX) or OUTPUT_SUFFIX + "_" in stem and stem.rsplit("_", 1)[1].isdigit()
+
+def find_workbooks(paths, out_dir=None):
+    """ Expands directories (recursively) into .xlsx files; skips Excel lock files,
+    the output folder and earlier outputs, so a rerun does not cost its own results. """
+    found = []
+    skip = os.path.realpath(out_dir) if out_dir else None
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs[:] = [d for d in dirs if os.path.realpath(os.path.join(root, d)) != skip]
+                if os.path.realpath(root) == skip: continue
+                for name in sorted(files):
+                    if name.lower().endswith(".xlsx") and not name.startswith("~$") and not is_output_name(name):
+                        found.append(os.path.join(root, name))
+        elif os.path.isfile(path):
+            found.append(path)
+        else:
+            print(f"Skipping {path}: not found", file=sys.stderr)
+    return found
+
+def output_stems(files, out_dir):
+    """ <name>_costed per input, numbered when two inputs share a file name. """
+    stems, seen = {}, {}
+    for path in files:
+        base = os.path.splitext(os.path.basename(path))[0] + OUTPUT_SUFFIX
+        n = seen.get(base, 0)
+        seen[base] = n + 1
+        stems[path] = os.path.join(out_dir, base if n == 0 else f"{base}_{n}")
+    return stems
+
+def write_csv(path, data):
+    # utf-8-sig so Excel shows Arabic product names correctly
+    with open(path, "w", newline="", encoding="utf-8-sig", buffering=1 << 16) as f:
+        writer = csv.writer(f)
+        writer.writerow(CSV_FIELDS)
+        writer.writerows([item[k] for k in CSV_FIELDS] for item in data)
+
+def cost_workbook(filepath, stem, exchange_rate, shipping_rate, formats):
+    """ Worker: parses and costs one file, writes its outputs. Returns a summary row. """
+    GLOBAL_SETTINGS["exchange_rate"] = exchange_rate
+    GLOBAL_SETTINGS["shipping_rate"] = shipping_rate
+    started = time.time()
+    summary = dict.fromkeys(SUMMARY_FIELDS, "")
+    summary.update(file=filepath, sheets=0, lines=0, total_investment=0, seconds=0)
+    try:
+        results, meta = parse_workbook(filepath)
+        if results is None:
+            summary["status"] = meta
+            return summary
+
+        outputs = []
+        if "xlsx" in formats and results:
+            out = stem + ".xlsx"
+            try:
+                patch_export(filepath, out, results, meta["sheets"])
+            except UnsupportedLayout:
+                export_with_openpyxl(filepath, out, results, meta["sheets"])
+            outputs.append(out)
+        if "csv" in formats:
+            write_csv(stem + ".csv", results)
+            outputs.append(stem + ".csv")
+
+        summary.update(status="Success", header_row=meta["header_row"], sheets=len(meta["sheets"]), lines=len(results),
+                       total_investment=round(meta["total_investment"], 2), outputs=" ".join(outputs))
+    except Exception as e:
+        summary["status"] = str(e)
+    summary["seconds"] = round(time.time() - started, 3)
+    return summary
+
+def run_batch(paths, out_dir, exchange_rate, shipping_rate, formats=("xlsx", "csv"), workers=None):
+    """ Costs every workbook across a process pool and writes summary.csv. Returns the summary rows in input order. """
+    files = find_workbooks(paths, out_dir)
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    stems = output_stems(files, out_dir)
+
+    summaries = {}
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        futures = {pool.submit(cost_workbook, path, stems[path], exchange_rate, shipping_rate, formats): path for path in files}
+        for done, future in enumerate(as_completed(futures), start=1):
+            summary = future.result()
+            summaries[futures[future]] = summary
+            print(f"[{done}/{len(files)}] {summary['status']}: {summary['file']} ({summary['lines']} lines)")
+
+    rows = [summaries[path] for path in files]
+    with open(os.path.join(out_dir, "summary.csv"), "w", newline="", encoding="utf-8-sig") as f:
+        writer = csv.DictWriter(f, fieldnames=SUMMARY_FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+        grand = sum(row["total_investment"] for row in rows)
+        writer.writerow({"file": "TOTAL", "status": "", "lines": sum(row["lines"] for row in rows), "total_investment": round(grand, 2)})
+    return rows
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Cost supplier workbooks without the app.")
+    parser.add_argument("inputs", nargs="+", help=".xlsx files or folders to scan")
+    parser.add_argument("-o", "--out", default="costed", help="output folder (default: ./costed)")
+    parser.add_argument("--exchange-rate", type=float, default=GLOBAL_SETTINGS["exchange_rate"])
+    parser.add_argument("--shipping-rate", type=float, default=GLOBAL_SETTINGS["shipping_rate"], help="DZD per CBM")
+    parser.add_argument("--format", choices=["xlsx", "csv", "both"], default="both")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="processes (default: all cores)")
+    args = parser.parse_args(argv)
+
+    formats = ("xlsx", "csv") if args.format == "both" else (args.format,)
+    rows = run_batch(args.inputs, args.out, args.exchange_rate, args.shipping_rate, formats, args.workers)
+    ok = [row for row in rows if row["status"] == "Success"]
+    print(f"{len(ok)}/{len(rows)} files costed, total {sum(r['total_investment'] for r in ok):,.2f} DA -> {os.path.join(args.out, 'summary.csv')}")
+    return 0 if len(ok) == len(rows) else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,345 @@
+import os
+import io
+import sys
+import json
+import time
+import re
+import random
+import shutil
+import argparse
+import tempfile
+import subprocess
+import zipfile
+import tracemalloc
+
+# Import/export/search/render timings on synthetic supplier workbooks.
+#   python benchmark.py                      # 1k / 10k / 50k rows
+#   python benchmark.py --sizes 2000 --images 50 --json bench.json
+# Every case runs in fresh processes, one timed and one under tracemalloc.
+# The startup and render cases need a window; on a headless box run them under xvfb-run.
+
+CASES = ["startup", "import", "import_warm", "watch", "export", "report", "search", "sort", "sweep", "allocate", "history", "render"]
+# Start-up must not pull these in; the startup case fails if it does
+STARTUP_DEFERRED = ["openpyxl", "kivy.uix.filechooser"]
+DEFAULT_SIZES = [1000, 10000, 50000]
+
+ITEM_WORDS = ["Chair", "Table", "LED Lamp", "Cable", "Bottle", "Mirror", "Shelf", "Fan", "Kettle", "Hanger"]
+ARABIC_WORDS = ["كرسي", "طاولة", "مصباح", "كابل", "قارورة", "مرآة", "رف", "مروحة", "غلاية", "علاقة"]
+
+# --- SYNTHETIC WORKBOOKS ---
+def make_workbook(path, rows, extra_cols=0, images=0, header_row=3, seed=1):
+    """ Packing list in the layout the importer expects: a few title rows, then
+    NO / ITEM / المنتوج / Price(RMB) / Ctn / Qty / CBM / Total / G.W (+ filler columns). """
+    import openpyxl
+    from openpyxl.drawing.image import Image as XLImage
+    from PIL import Image as PILImage
+
+    rnd = random.Random(seed)
+    # Pictures can only be anchored in a normal workbook; write-only is much faster otherwise
+    wb = openpyxl.Workbook(write_only=not images)
+    sheet = wb.create_sheet("Packing List") if not images else wb.active
+
+    headers = ["NO", "ITEM", "المنتوج", "Price(RMB)", "Ctn", "Qty", "CBM", "Total", "G.W"] + [f"Remark {i}" for i in range(extra_cols)]
+    lines = [["PROFORMA INVOICE"], [f"Supplier {seed}", "", "", "Yiwu"]][:header_row - 1]
+    lines += [[] for _ in range(header_row - 1 - len(lines))]
+    lines.append(headers)
+    # Pictures go on every step-th line, which always has cartons so it is costed
+    step = max(1, rows // max(images, 1))
+    picture_lines = {k * step for k in range(images)}
+    for n in range(rows):
+        r = header_row + 1 + n
+        word = rnd.randrange(len(ITEM_WORDS))
+        # Some suppliers leave ITEM empty and only fill the Arabic name
+        item = "" if n % 7 == 0 else f"{ITEM_WORDS[word]} {rnd.randint(100, 999)}"
+        ctn = 0 if n % 25 == 0 and n not in picture_lines else rnd.randint(1, 40)
+        lines.append([n + 1, item, f"{ARABIC_WORDS[word]} {n}", round(rnd.uniform(0.5, 300), 2), ctn,
+                      rnd.choice([1, 6, 12, 24, 48, 100]), round(rnd.uniform(0.01, 0.4), 3),
+                      f"=D{r}*E{r}*F{r}", round(rnd.uniform(2, 30), 1)] + [f"note {n}"] * extra_cols)
+    for line in lines:
+        sheet.append(line)
+
+    for k in range(images):
+        buf = io.BytesIO()
+        PILImage.new("RGB", (800, 600), (rnd.randrange(256), rnd.randrange(256), rnd.randrange(256))).save(buf, "JPEG")
+        buf.seek(0)
+        sheet.add_image(XLImage(buf), f"I{header_row + 1 + k * step}")
+    wb.save(path)
+
+def edit_price(path, row, price):
+    """ Rewrites one Price(RMB) cell of the first sheet, as saving the workbook after an edit would. """
+    part = "xl/worksheets/sheet1.xml"
+    with zipfile.ZipFile(path) as archive:
+        entries = [(info, archive.read(info.filename)) for info in archive.infolist()]
+    tmp = path + ".tmp"
+    with zipfile.ZipFile(tmp, "w", zipfile.ZIP_DEFLATED) as archive:
+        for info, data in entries:
+            if info.filename == part:
+                data = re.sub(rf'<c r="D{row}"[^>]*?(?:/>|>.*?</c>)', f'<c r="D{row}" t="n"><v>{price}</v></c>',
+                              data.decode("utf-8"), count=1, flags=re.S).encode("utf-8")
+            archive.writestr(info, data)
+    mtime = os.stat(path).st_mtime + 1
+    os.replace(tmp, path)
+    os.utime(path, (mtime, mtime))
+
+# --- MEASUREMENT ---
+def measure(fn, trace=False):
+    """ Wall seconds of fn(), or with trace=True the peak MB Python allocated while it ran.
+    The two are taken in separate processes: tracemalloc itself slows the code down. """
+    if trace:
+        tracemalloc.start()
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return peak / 1e6
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+# --- CASES (run inside a child process) ---
+def run_case(case, workbook, work_dir, trace):
+    if case == "startup":
+        # Cold start up to the first drawn frame: imports, home screen, one frame
+        os.environ.setdefault("KIVY_NO_ARGS", "1")
+        os.environ.setdefault("KIVY_NO_CONSOLELOG", "1")
+        os.environ["XDG_CONFIG_HOME"] = work_dir  # app.user_data_dir goes to the scratch folder
+        def startup():
+            from kivy.base import EventLoop
+            import main
+            app = main.ImportApp()
+            main.Window.add_widget(app.build())
+            EventLoop.idle()
+        result = measure(startup, trace)
+        loaded = [name for name in STARTUP_DEFERRED if name in sys.modules]
+        if loaded: raise RuntimeError(f"start-up imported {', '.join(loaded)}")
+        return result
+
+    import engine
+
+    data_dir = os.path.join(work_dir, "data")
+    if case == "import":
+        return measure(lambda: engine.parse_workbook(workbook, data_dir), trace)
+    if case == "import_warm":
+        engine.parse_workbook(workbook, data_dir)
+        return measure(lambda: engine.parse_workbook(workbook, data_dir), trace)
+
+    results, meta = engine.parse_workbook(workbook, data_dir)
+    # The gallery, thumbnail and texture paths are only covered if costed lines have pictures
+    with zipfile.ZipFile(workbook) as archive:
+        has_pictures = any(name.startswith("xl/media/") for name in archive.namelist())
+    if has_pictures and not results.image_count():
+        raise RuntimeError("no costed line has a picture")
+    engine.SESSION_STATE.update(meta)
+    engine.SESSION_STATE["data"] = results
+
+    if case == "watch":
+        # One price edited and saved: re-read the sheet XML, diff it and patch the store
+        watched = os.path.join(work_dir, "watched.xlsx")
+        shutil.copy2(workbook, watched)
+        watch = engine.WorkbookWatch(results, watched, meta["sheets"], engine.file_stamp(watched), data_dir)
+        watch.check()
+        edit_price(watched, meta["header_row"] + 2, 123.45)
+        def reload():
+            changes = watch.check()
+            if not isinstance(changes, dict) or len(changes) != 1: raise RuntimeError(f"unexpected watch result {changes!r}")
+            results.apply(changes)
+        return measure(reload, trace)
+
+    if case == "export":
+        engine.export_output_path = lambda: os.path.join(work_dir, "export.xlsx")
+        def export():
+            ok, msg = engine.export_results_smart()
+            if not ok: raise RuntimeError(msg)
+        return measure(export, trace)
+
+    if case == "report":
+        engine.export_output_path = lambda prefix, extension: os.path.join(work_dir, f"{prefix}.{extension}")
+        def report():
+            for extension in ("xlsx", "csv"):
+                ok, msg = engine.export_report(extension)
+                if not ok: raise RuntimeError(msg)
+        return measure(report, trace)
+
+    if case == "search":
+        def search():
+            # Index build + a user typing a product name one key at a time
+            index = engine.SearchIndex(results.name_column())
+            for query in ("l", "le", "led", "led ", "led l", "led la", "led lamp", "مص", "مصب", "مصباح"):
+                index.search(query)
+        return measure(search, trace)
+
+    if case == "sort":
+        def sort():
+            # First build of every order, a rate change, then the same by product
+            for key in engine.SORT_KEYS:
+                results.sort.arrange(key, descending=True)
+            results.engine.recompute(40.0, 60000.0)
+            results.sort.arrange("unit_cost")
+            groups = results.groups()
+            for key in engine.SORT_KEYS:
+                groups.sort.arrange(key)
+        return measure(sort, trace)
+
+    if case == "sweep":
+        def sweep():
+            # 20 x 20 rate grid plus the line-level costs of one scenario
+            grid = engine.ScenarioSweep(results.engine, engine.rate_steps(30, 42, 20), engine.rate_steps(40000, 60000, 20))
+            grid.unit_costs(grid.exchange_rates[-1], grid.shipping_rates[-1])
+        return measure(sweep, trace)
+
+    if case == "allocate":
+        def allocate():
+            # A container invoice plus two fees, tried on every basis the way the Freight popup does
+            allocator = engine.FreightAllocator(results.engine)
+            for basis in allocator.available():
+                allocator.apply([1850000, 45000, 12500.5], basis)
+            allocator.clear()
+        return measure(allocate, trace)
+
+    if case == "history":
+        def history():
+            # Record the import under 5 names, then re-price all of them at new rates
+            store = engine.HistoryStore(os.path.join(work_dir, engine.HISTORY_NAME))
+            try:
+                for k in range(5):
+                    snapshot = engine.ImportSnapshot(results, meta["sheets"])
+                    store.record_import(os.path.join(work_dir, f"shipment_{k}.xlsx"), snapshot)
+                store.reprice(40.0, 61000.0)
+            finally:
+                store.close()
+        return measure(history, trace)
+
+    if case == "render":
+        os.environ.setdefault("KIVY_NO_ARGS", "1")
+        os.environ.setdefault("KIVY_NO_CONSOLELOG", "1")
+        from kivy.base import EventLoop
+        from kivy.uix.screenmanager import ScreenManager
+        import main
+
+        manager = ScreenManager()
+        screen = main.ResultsScreen(name="results")
+        manager.add_widget(screen)
+        main.Window.add_widget(manager)
+        def render():
+            screen.load_data()
+            EventLoop.idle()
+            for _ in main.VIEW_MODES:
+                screen.toggle_view(None)
+                EventLoop.idle()
+        return measure(render, trace)
+
+    raise ValueError(f"unknown case {case}")
+
+def result_memory(workbook):
+    """ Bytes per line of the import results: the old list of record dicts (plus
+    the CostEngine arrays it kept next to it) against the column ResultStore.
+    Measured: about 520 B/line for dicts against 90-125 B/line for the store, a 4-6x
+    cut, not 10x. The store's fixed columns alone (7 float64 + 4 int32) take 72 B/line,
+    so 10x would mean dropping to float32 prices or recomputing costs on every read. """
+    import engine
+
+    results, _ = engine.parse_workbook(workbook)
+    e = results.engine
+    raw = [(results.sheet_id[i], results.row_index[i], str(results.name(i)), e.rmb[i], e.ctn[i], e.qty[i], e.cbm[i], e.kg[i], results.image(i))
+           for i in range(len(results))]
+
+    def traced(build):
+        tracemalloc.start()
+        kept = build()
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del kept
+        return size
+
+    # Fresh name strings per record, as iter_rows hands them out
+    sheets = [{"name": name, "header_row": 0, "col_map": {}} for name in results.sheets]
+    dicts = traced(lambda: (engine._cost_cached_rows(sheets, raw)[0].engine,
+                            [dict(item, name=item["name"][:1] + item["name"][1:]) for item in results]))
+    store = traced(lambda: engine._cost_cached_rows(sheets, raw)[0])
+    lines = max(len(results), 1)
+    return {"lines": len(results), "dict_bytes": round(dicts / lines), "store_bytes": round(store / lines)}
+
+def child_main(case, workbook, mode):
+    work_dir = tempfile.mkdtemp(prefix="costcalc_bench_")
+    try:
+        print(json.dumps(run_case(case, workbook, work_dir, mode == "memory")))
+    except Exception as e:
+        # Kivy's logger may swallow stderr, so the parent reads the reason from stdout
+        print(json.dumps({"error": f"{type(e).__name__}: {e}"}))
+        return 1
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+# --- DRIVER ---
+def run_child(case, workbook, mode):
+    here = os.path.dirname(os.path.abspath(__file__))
+    proc = subprocess.run([sys.executable, os.path.join(here, "benchmark.py"), "--child", case, workbook, mode],
+                          capture_output=True, text=True, cwd=here)
+    lines = proc.stdout.strip().splitlines()
+    try:
+        result = json.loads(lines[-1])
+    except (IndexError, ValueError):
+        result = {"error": (proc.stderr.strip().splitlines() or ["failed"])[-1]}
+    if proc.returncode != 0 or isinstance(result, dict):
+        raise RuntimeError(result.get("error", "failed") if isinstance(result, dict) else "failed")
+    return result
+
+def run_suite(sizes, cases, extra_cols, images, header_row, repeat):
+    """ Runs every case at every size. Returns (report, failures); a case that raises,
+    including the startup import check, is a failure, not a skip. """
+    report, failures = [], []
+    with tempfile.TemporaryDirectory(prefix="costcalc_books_") as books:
+        for rows in sizes:
+            workbook = os.path.join(books, f"bench_{rows}.xlsx")
+            started = time.perf_counter()
+            make_workbook(workbook, rows, extra_cols, images, header_row)
+            print(f"# {rows} rows: generated {os.path.getsize(workbook) / 1e6:.1f} MB in {time.perf_counter() - started:.1f}s")
+
+            for case in cases:
+                try:
+                    seconds = min(run_child(case, workbook, "time") for _ in range(repeat))
+                    peak = run_child(case, workbook, "memory")
+                except RuntimeError as e:
+                    failures.append({"case": case, "rows": rows, "error": str(e)})
+                    print(f"  {case:<12} FAILED: {e}")
+                    continue
+                entry = {"case": case, "rows": rows, "images": images, "seconds": round(seconds, 4), "peak_mb": round(peak, 1)}
+                report.append(entry)
+                print(f"  {case:<12} {entry['seconds']:>9.3f}s  {entry['peak_mb']:>8.1f} MB")
+    return report, failures
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark import/export/search/render on synthetic workbooks.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="row counts")
+    parser.add_argument("--cases", nargs="+", choices=CASES, default=CASES)
+    parser.add_argument("--columns", type=int, default=4, help="extra filler columns")
+    parser.add_argument("--images", type=int, default=20)
+    parser.add_argument("--header-row", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=1, help="runs per case, best time is kept")
+    parser.add_argument("--json", help="also write the report here")
+    parser.add_argument("--result-memory", action="store_true", help="only compare dict rows with the ResultStore")
+    parser.add_argument("--child", nargs=3, metavar=("CASE", "WORKBOOK", "MODE"), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        return child_main(*args.child)
+    if args.result_memory:
+        with tempfile.TemporaryDirectory(prefix="costcalc_books_") as books:
+            for rows in args.sizes:
+                workbook = os.path.join(books, f"bench_{rows}.xlsx")
+                make_workbook(workbook, rows, args.columns, 0, args.header_row)
+                m = result_memory(workbook)
+                print(f"{rows:>8} rows  dicts {m['dict_bytes']:>5} B/line  store {m['store_bytes']:>4} B/line")
+        return 0
+
+    report, failures = run_suite(args.sizes, args.cases, args.columns, args.images, args.header_row, args.repeat)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report + failures, f, indent=2)  # failed cases carry "error" instead of timings
+    # CI fails on any crashing case, and on the startup check in particular
+    if failures:
+        print(f"{len(failures)} case(s) failed: " + ", ".join(f"{f['case']}@{f['rows']}" for f in failures))
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -8,7 +8,7 @@ version = 0.1
 
 # 1. CLEAN REQUIREMENTS (Removed 'androidstorage4kivy' which causes crashes)
 # Added 'pillow' to the list
-requirements = python3,kivy,android,openpyxl,et_xmlfile,jdcal,pillow
+requirements = python3,kivy,android,openpyxl,et_xmlfile,jdcal,pillow,sqlite3
 orientation = portrait
 fullscreen = 0
 
@@ -0,0 +1,2032 @@
+import os
+import io
+import math
+import time
+import hashlib
+import json
+import csv
+import re
+import tempfile
+import posixpath
+import sqlite3
+import threading
+import zipfile
+import xml.etree.ElementTree as ET
+from array import array
+from itertools import accumulate
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# Costing, import and export logic. Kept free of Kivy so batch.py can run it headless.
+# openpyxl and PIL are imported where they are used: the app starts without them.
+IS_ANDROID = "ANDROID_ARGUMENT" in os.environ  # same check kivy.utils.platform uses
+
+# --- CONFIGURATION ---
+GLOBAL_SETTINGS = {
+    "exchange_rate": 36.0,    
+    "shipping_rate": 50000.0, 
+    "margin_percent": 0.0     
+}
+
+SESSION_STATE = {
+    "data": [],
+    "filepath": None,
+    "file_stamp": None,  # (size, mtime) of filepath as it was imported
+    "header_row": 1,
+    "col_map": {},
+    "sheets": [],  # [{"name", "header_row", "col_map"}] per imported sheet, index = sheet id
+    "total_investment": 0,
+    "engine": None,
+    "history_id": None  # set when the import was opened from the history instead of its file
+}
+
+# --- TRACING ---
+TRACE_LOG_NAME = "trace.jsonl"
+TRACE_LOG_MAX = 512 * 1024  # bytes before the log rotates to trace.jsonl.1
+
+class _NullSpan:
+    def __enter__(self): return self
+    def __exit__(self, *exc): return False
+    def set(self, **counts): pass
+
+NULL_SPAN = _NullSpan()
+
+class _Span:
+    __slots__ = ("tracer", "run", "phase", "counts", "start")
+
+    def __init__(self, tracer, run, phase, counts):
+        self.tracer, self.run, self.phase, self.counts = tracer, run, phase, counts
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.tracer.record(self.run, self.phase, time.perf_counter() - self.start, **self.counts)
+        return False
+
+    def set(self, **counts):
+        self.counts.update(counts)
+
+class Tracer:
+    """ Phase timings for import, export and rendering, appended to a rotating JSONL log.
+    Off by default (COSTCALC_TRACE=1 turns it on): span() then returns a shared no-op. """
+    def __init__(self):
+        self.enabled = os.environ.get("COSTCALC_TRACE") == "1"
+        self.log_path = None
+        self.last = {}  # run -> spans of its latest execution
+        self.lock = threading.Lock()
+
+    def begin(self, run):
+        if self.enabled:
+            with self.lock: self.last[run] = []
+
+    def span(self, run, phase, **counts):
+        if not self.enabled: return NULL_SPAN
+        return _Span(self, run, phase, counts)
+
+    def record(self, run, phase, seconds, **counts):
+        if not self.enabled: return
+        entry = {"ts": round(time.time(), 3), "run": run, "phase": phase, "ms": round(seconds * 1000, 2)}
+        entry.update(counts)
+        with self.lock:
+            self.last.setdefault(run, []).append(entry)
+            if self.log_path: self._write(entry)
+
+    def _write(self, entry):
+        try:
+            if os.path.exists(self.log_path) and os.path.getsize(self.log_path) > TRACE_LOG_MAX:
+                os.replace(self.log_path, self.log_path + ".1")
+            with open(self.log_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        except OSError as e:
+            print(f"Trace Error: {e}")
+
+    def summary(self):
+        """ Plain-text breakdown of the last run of each kind. """
+        lines = []
+        with self.lock:
+            runs = {run: list(spans) for run, spans in self.last.items()}
+        for run, spans in runs.items():
+            lines.append(f"{run.upper():<8}{sum(s['ms'] for s in spans):>10.1f} ms")
+            for s in spans:
+                extra = " ".join(f"{k}={v}" for k, v in s.items() if k not in ("ts", "run", "phase", "ms"))
+                lines.append(f"  {s['phase']:<16}{s['ms']:>8.1f} ms  {extra}")
+        return "\n".join(lines) or "No trace yet"
+
+TRACER = Tracer()
+
+# --- COSTING ENGINE ---
+def landed_unit_cost(rmb_price, cbm_per_box, units_per_box, exchange_rate, shipping_rate):
+    """ (CBM * Rate) / Qty + RMB * Exchange """
+    return rmb_price * exchange_rate + cbm_per_box * shipping_rate / units_per_box
+
+class CostEngine:
+    """ Raw costing columns of one import, kept as typed arrays so every line
+    can be re-priced in one pass when the rates change, without reopening the file. """
+    def __init__(self, exchange_rate=None, shipping_rate=None):
+        self.exchange_rate = GLOBAL_SETTINGS["exchange_rate"] if exchange_rate is None else exchange_rate
+        self.shipping_rate = GLOBAL_SETTINGS["shipping_rate"] if shipping_rate is None else shipping_rate
+        self.rmb = array('d')
+        self.ctn = array('d')
+        self.qty = array('d')   # units per box
+        self.cbm = array('d')   # per box
+        self.kg = array('d')    # gross weight per box, 0 when the sheet has no weight column
+        self.unit_cost = array('d')
+        self.total_line = array('d')
+        self.total_investment = 0.0
+        self.version = 0  # bumped by recompute, so caches of prices know they are stale
+        # Set by FreightAllocator.apply: freight comes from a container invoice instead of the CBM rate
+        self.allocation = None  # (charges in DA, basis)
+        self.freight = None     # array('d'): the charges split per line, in DA
+
+    def __len__(self):
+        return len(self.rmb)
+
+    def add_line(self, rmb_price, boxes_count, units_per_box, cbm_per_box, kg_per_box=0.0):
+        """ Appends one line priced at the engine's rates. Returns (unit_cost, total_line). """
+        unit_cost = landed_unit_cost(rmb_price, cbm_per_box, units_per_box, self.exchange_rate, self.shipping_rate)
+        total_line = unit_cost * (boxes_count * units_per_box)
+        self.rmb.append(rmb_price)
+        self.ctn.append(boxes_count)
+        self.qty.append(units_per_box)
+        self.cbm.append(cbm_per_box)
+        self.kg.append(kg_per_box)
+        self.unit_cost.append(unit_cost)
+        self.total_line.append(total_line)
+        self.total_investment += total_line
+        return unit_cost, total_line
+
+    def extend(self, other):
+        """ Appends the lines of another engine priced at the same rates. """
+        for column in ("rmb", "ctn", "qty", "cbm", "kg", "unit_cost", "total_line"):
+            getattr(self, column).extend(getattr(other, column))
+        self.total_investment += other.total_investment
+
+    def recompute(self, exchange_rate=None, shipping_rate=None):
+        """ Re-prices every line at the given (default: current GLOBAL_SETTINGS) rates.
+        With an allocation applied, the allocated freight replaces CBM * shipping rate. """
+        ex = GLOBAL_SETTINGS["exchange_rate"] if exchange_rate is None else exchange_rate
+        sh = GLOBAL_SETTINGS["shipping_rate"] if shipping_rate is None else shipping_rate
+        if self.freight is None:
+            self.unit_cost = array('d', [r * ex + c * sh / q for r, c, q in zip(self.rmb, self.cbm, self.qty)])
+        else:
+            self.unit_cost = array('d', [r * ex + f / (b * q) for r, f, b, q in zip(self.rmb, self.freight, self.ctn, self.qty)])
+        self.total_line = array('d', [u * (b * q) for u, b, q in zip(self.unit_cost, self.ctn, self.qty)])
+        self.total_investment = math.fsum(self.total_line)
+        self.exchange_rate, self.shipping_rate = ex, sh
+        self.version += 1
+
+def reprice_session():
+    """ Applies the current rates to the loaded import. Returns False when nothing changed. """
+    engine = SESSION_STATE.get("engine")
+    if engine is None: return False
+    if (engine.exchange_rate, engine.shipping_rate) == (GLOBAL_SETTINGS["exchange_rate"], GLOBAL_SETTINGS["shipping_rate"]):
+        return False
+    # The ResultStore reads its prices from the engine, so this is the whole update
+    engine.recompute()
+    SESSION_STATE["total_investment"] = engine.total_investment
+    return True
+
+# --- RESULT STORE ---
+class ResultStore:
+    """ The rows of one import as parallel columns instead of one dict per line.
+    Prices come straight from the CostEngine arrays, names and image paths are
+    interned and referenced by id. store[i] builds the usual record dict on demand.
+    sheet_id points into `sheets`, the names of the imported sheets.
+    `revision` is bumped whenever lines are edited in place (see apply).
+    About 4-6x smaller than the dicts (benchmark.py --result-memory); the float64
+    costing columns set the floor at 72 B a line. """
+    def __init__(self, engine=None):
+        self.engine = engine if engine is not None else CostEngine()
+        self.row_index = array('i')
+        self.name_id = array('i')
+        self.image_id = array('i')
+        self.sheet_id = array('i')
+        self.sheets = []
+        self.names = []
+        self.images = [None]  # id 0 = no picture
+        self._name_ids = {}
+        self._image_ids = {None: 0}
+        self.revision = 0
+        self.sort = SortOrders(self)
+        self._groups = None
+
+    def _intern(self, item_name, image):
+        name_id = self._name_ids.get(item_name)
+        if name_id is None:
+            name_id = self._name_ids[item_name] = len(self.names)
+            self.names.append(item_name)
+        image_id = self._image_ids.get(image)
+        if image_id is None:
+            image_id = self._image_ids[image] = len(self.images)
+            self.images.append(image)
+        return name_id, image_id
+
+    def add(self, r, item_name, image, sheet_id=0):
+        """ Registers the line just added to the engine. image_id goes last: its
+        length is the row count a reader on another thread may rely on. """
+        name_id, image_id = self._intern(item_name, image)
+        self.row_index.append(r)
+        self.name_id.append(name_id)
+        self.sheet_id.append(sheet_id)
+        self.image_id.append(image_id)
+
+    def line(self, i):
+        """ The costing inputs of row i, as WorkbookWatch reads them back from the sheet. """
+        e = self.engine
+        return (self.name(i), e.rmb[i], e.ctn[i], e.qty[i], e.cbm[i], e.kg[i], self.image(i))
+
+    def apply(self, changes):
+        """ Applies {(sheet_id, row): line or None} from WorkbookWatch.check in place.
+        Edited lines are re-costed at the engine's rates. Added and removed lines rebuild
+        the columns in sheet order, copying the other lines' prices. A freight allocation is
+        split again over the new lines. Returns (added, changed, removed). """
+        e = self.engine
+        ex, sh = e.exchange_rate, e.shipping_rate
+        positions = {key: i for i, key in enumerate(zip(self.sheet_id, self.row_index))}
+        added = sorted(key for key, line in changes.items() if line is not None and key not in positions)
+        removed = {positions[key] for key, line in changes.items() if line is None and key in positions}
+        names, images = self.name_column(), [self.images[i] for i in self.image_id]
+        changed = 0
+        for key, line in changes.items():
+            i = positions.get(key)
+            if i is None or line is None: continue
+            names[i], e.rmb[i], e.ctn[i], e.qty[i], e.cbm[i], e.kg[i], images[i] = line
+            e.unit_cost[i] = landed_unit_cost(e.rmb[i], e.cbm[i], e.qty[i], ex, sh)
+            e.total_line[i] = e.unit_cost[i] * (e.ctn[i] * e.qty[i])
+            changed += 1
+
+        if added or removed:
+            order = sorted([(s, r, i) for i, (s, r) in enumerate(zip(self.sheet_id, self.row_index)) if i not in removed] +
+                           [(s, r, -1) for s, r in added])
+            new = CostEngine(ex, sh)
+            new_names, new_images = [], []
+            for s, r, i in order:
+                if i < 0:
+                    name, rmb, ctn, qty, cbm, kg, image = changes[s, r]
+                    unit_cost = landed_unit_cost(rmb, cbm, qty, ex, sh)
+                    line = (rmb, ctn, qty, cbm, kg, unit_cost, unit_cost * (ctn * qty))
+                else:
+                    name, image = names[i], images[i]
+                    line = (e.rmb[i], e.ctn[i], e.qty[i], e.cbm[i], e.kg[i], e.unit_cost[i], e.total_line[i])
+                for column, value in zip((new.rmb, new.ctn, new.qty, new.cbm, new.kg, new.unit_cost, new.total_line), line):
+                    column.append(value)
+                new_names.append(name)
+                new_images.append(image)
+            # The engine object is shared through SESSION_STATE, so only its columns are swapped
+            e.rmb, e.ctn, e.qty, e.cbm, e.kg = new.rmb, new.ctn, new.qty, new.cbm, new.kg
+            e.unit_cost, e.total_line = new.unit_cost, new.total_line
+            self.sheet_id = array('i', [s for s, _, _ in order])
+            self.row_index = array('i', [r for _, r, _ in order])
+            names, images = new_names, new_images
+
+        # Re-intern from scratch so names no line uses any more do not linger as empty groups
+        self.names, self.images = [], [None]
+        self._name_ids, self._image_ids = {}, {None: 0}
+        ids = [self._intern(name, image) for name, image in zip(names, images)]
+        self.name_id = array('i', [name_id for name_id, _ in ids])
+        self.image_id = array('i', [image_id for _, image_id in ids])
+        e.total_investment = math.fsum(e.total_line)
+        if e.allocation is not None:
+            allocator = FreightAllocator(e)
+            try:
+                allocator.apply(*e.allocation)
+            except ValueError as err:
+                print(f"Freight allocation dropped: {err}")
+                allocator.clear()
+        self.revision += 1
+        return len(added), changed, len(removed)
+
+    def extend(self, other, sheet_name):
+        """ Appends another sheet's rows, and its engine lines, under `sheet_name`. """
+        sheet_id = len(self.sheets)
+        self.sheets.append(sheet_name)
+        self.engine.extend(other.engine)
+        for r, name_id, image_id in zip(other.row_index, other.name_id, other.image_id):
+            self.add(r, other.names[name_id], other.images[image_id], sheet_id)
+
+    def __len__(self):
+        return len(self.image_id)
+
+    def __getitem__(self, i):
+        e = self.engine
+        return result_record(self.row_index[i], self.names[self.name_id[i]], e.unit_cost[i], e.total_line[i],
+                             e.rmb[i], e.ctn[i], e.qty[i], self.images[self.image_id[i]], self.sheet(i))
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def name(self, i):
+        return self.names[self.name_id[i]]
+
+    def image(self, i):
+        return self.images[self.image_id[i]]
+
+    def sheet(self, i):
+        return self.sheets[self.sheet_id[i]] if self.sheets else ""
+
+    def name_column(self):
+        names = self.names
+        return [names[i] for i in self.name_id]
+
+    def image_count(self):
+        return sum(1 for i in self.image_id if i)
+
+    def sheet_totals(self):
+        """ Total investment of each sheet, in sheet order. """
+        totals = [0.0] * max(len(self.sheets), 1)
+        for sheet_id, total_line in zip(self.sheet_id, self.engine.total_line):
+            totals[sheet_id] += total_line
+        return totals
+
+    def column(self, key):
+        """ One sortable column (see SORT_KEYS), in row order. """
+        e = self.engine
+        if key == "unit_cost": return e.unit_cost
+        if key == "total_line": return e.total_line
+        if key == "rmb_price": return e.rmb
+        if key == "qty": return array('d', [b * q for b, q in zip(e.ctn, e.qty)])
+        if key == "name":
+            folded = [name.casefold() for name in self.names]
+            return [folded[i] for i in self.name_id]
+        raise KeyError(key)
+
+    def groups(self):
+        """ Lines merged by product name, rebuilt once after each import or rate change. """
+        if self._groups is None or self._groups.stamp != (self.engine.version, self.revision, len(self)):
+            self._groups = ProductGroups(self)
+        return self._groups
+
+    def unit_costs_by_row(self, sheet_id=0):
+        """ {sheet row: rounded unit cost} of one sheet, what the exporters write back. """
+        return {r: round(u, 2) for r, s, u in zip(self.row_index, self.sheet_id, self.engine.unit_cost) if s == sheet_id}
+
+# --- SORT & GROUP ---
+SORT_KEYS = ("unit_cost", "total_line", "qty", "rmb_price", "name")
+PRICE_KEYS = ("unit_cost", "total_line")  # these move when the rates change
+
+class SortOrders:
+    """ Row order and rank by each sortable column of `source` (a ResultStore or
+    ProductGroups), built on first use and kept until the rows, their revision or the rates change.
+    A stale price order is re-sorted starting from itself: after a rate change it is
+    nearly in order already, which Timsort handles in close to one pass. """
+    def __init__(self, source):
+        self.source = source
+        self.orders = {}  # key -> (stamp, order, rank)
+
+    def _entry(self, key):
+        stamp = (self.source.engine.version if key in PRICE_KEYS else 0, self.source.revision, len(self.source))
+        cached = self.orders.get(key)
+        if cached is not None and cached[0] == stamp:
+            return cached
+        values = self.source.column(key)
+        start = cached[1] if cached is not None and len(cached[1]) == len(values) else range(len(values))
+        order = array('i', sorted(start, key=values.__getitem__))
+        rank = array('i', bytes(4 * len(order)))
+        for position, i in enumerate(order):
+            rank[i] = position
+        self.orders[key] = (stamp, order, rank)
+        return self.orders[key]
+
+    def arrange(self, key, rows=None, descending=False):
+        """ Positions in `key` order, all of them or only `rows` (e.g. search hits). """
+        _, order, rank = self._entry(key)
+        if rows is None:
+            return order[::-1] if descending else order
+        return sorted(rows, key=rank.__getitem__, reverse=descending)
+
+class ProductGroups:
+    """ One entry per distinct product name: summed units, totals and RMB value, and
+    the first line's row and picture. groups[i] builds a record like ResultStore's. """
+    def __init__(self, store):
+        e = store.engine
+        count = len(store.names)
+        self.engine = e
+        self.stamp = (e.version, store.revision, len(store))
+        self.revision = store.revision
+        self.store = store
+        self.sheets = store.sheets
+        self.lines = array('i', bytes(4 * count))
+        self.first = array('i', [-1]) * count
+        units, totals, rmb_value = [0.0] * count, [0.0] * count, [0.0] * count
+        for i, (name_id, b, q, r, t) in enumerate(zip(store.name_id, e.ctn, e.qty, e.rmb, e.total_line)):
+            if self.first[name_id] < 0: self.first[name_id] = i
+            self.lines[name_id] += 1
+            units[name_id] += b * q
+            totals[name_id] += t
+            rmb_value[name_id] += r * (b * q)
+        self.units = array('d', units)
+        self.totals = array('d', totals)
+        self.rmb_value = array('d', rmb_value)
+        self.sort = SortOrders(self)
+
+    def __len__(self):
+        return len(self.lines)
+
+    def __getitem__(self, g):
+        units = self.units[g] or 1
+        first = self.first[g]
+        return {
+            "row_index": self.store.row_index[first],
+            "name": self.store.names[g],
+            "unit_cost": round(self.totals[g] / units, 2),
+            "total_line": round(self.totals[g], 2),
+            "rmb_price": round(self.rmb_value[g] / units, 2),
+            "qty": int(self.units[g]),
+            "image": self.store.image(first),
+            "sheet": "",
+            "lines": self.lines[g],
+        }
+
+    def name_column(self):
+        return self.store.names
+
+    def column(self, key):
+        if key == "unit_cost": return array('d', [t / (u or 1) for t, u in zip(self.totals, self.units)])
+        if key == "total_line": return self.totals
+        if key == "qty": return self.units
+        if key == "rmb_price": return array('d', [r / (u or 1) for r, u in zip(self.rmb_value, self.units)])
+        if key == "name": return [name.casefold() for name in self.store.names]
+        raise KeyError(key)
+
+# --- SCENARIOS ---
+def rate_steps(start, stop, steps):
+    """ `steps` evenly spaced rates from start to stop, both included. """
+    if steps <= 1: return [float(start)]
+    step = (stop - start) / (steps - 1)
+    return [start + step * k for k in range(steps)]
+
+class ScenarioSweep:
+    """ What-if grid of exchange x shipping rates over one import. A line's landed
+    total is linear in both rates:
+        total_line = ex * (rmb * ctn * qty) + sh * (cbm * ctn)
+    so one pass over the engine columns reduces the import to three sums, and each
+    scenario then costs a couple of multiplications whatever the line count.
+    With a freight allocation applied, sh * volume becomes the allocated freight,
+    which no shipping rate moves. """
+    def __init__(self, engine, exchange_rates, shipping_rates):
+        self.engine = engine
+        self.exchange_rates = list(exchange_rates)
+        self.shipping_rates = list(shipping_rates)
+        self.goods_rmb = math.fsum(r * (b * q) for r, b, q in zip(engine.rmb, engine.ctn, engine.qty))
+        self.volume_cbm = math.fsum(c * b for c, b in zip(engine.cbm, engine.ctn))
+        self.units = math.fsum(b * q for b, q in zip(engine.ctn, engine.qty))
+        self.freight = math.fsum(engine.freight) if engine.freight is not None else None
+        # totals[i][j]: total_investment at exchange_rates[i], shipping_rates[j]
+        self.totals = [[ex * self.goods_rmb + (sh * self.volume_cbm if self.freight is None else self.freight)
+                        for sh in self.shipping_rates]
+                       for ex in self.exchange_rates]
+
+    def __len__(self):
+        return len(self.exchange_rates) * len(self.shipping_rates)
+
+    def cost_per_unit(self, i, j):
+        """ Average landed cost of one piece in scenario (i, j). """
+        return self.totals[i][j] / self.units if self.units else 0.0
+
+    def unit_costs(self, exchange_rate, shipping_rate):
+        """ Every line's unit cost under one scenario, in ResultStore order. """
+        e = self.engine
+        if e.freight is not None:
+            return array('d', [r * exchange_rate + f / (b * q) for r, f, b, q in zip(e.rmb, e.freight, e.ctn, e.qty)])
+        return array('d', [r * exchange_rate + c * shipping_rate / q for r, c, q in zip(e.rmb, e.cbm, e.qty)])
+
+    def write_csv(self, path):
+        """ Sensitivity tables, one row per exchange rate and one column per shipping rate. """
+        head = ["Exchange \\ Shipping (DA/CBM)"] + [round(sh, 2) for sh in self.shipping_rates]
+        with open(path, "w", newline="", encoding="utf-8-sig") as f:
+            writer = csv.writer(f)
+            writer.writerow(["Total investment (DA)"])
+            writer.writerow(head)
+            for ex, row in zip(self.exchange_rates, self.totals):
+                writer.writerow([round(ex, 4)] + [round(total, 2) for total in row])
+            writer.writerow([])
+            writer.writerow(["Average cost per unit (DA)"])
+            writer.writerow(head)
+            for i, ex in enumerate(self.exchange_rates):
+                writer.writerow([round(ex, 4)] + [round(self.cost_per_unit(i, j), 2) for j in range(len(self.shipping_rates))])
+
+# --- FREIGHT ALLOCATION ---
+ALLOCATION_BASES = ("volume", "weight", "value")
+ALLOCATION_UNIT = 100  # charges are split in centimes, so the shares add up to the invoice exactly
+
+class FreightAllocator:
+    """ Spreads container-level charges (a groupage invoice total plus fixed fees) over
+    the lines of one import, in proportion to each line's volume (ctn * cbm), gross
+    weight (ctn * kg) or goods value (rmb * ctn * qty). The running total of the shares is
+    rounded to the centime rather than each share, so every line is within a centime of its
+    exact share and the lines add up to the invoice exactly, without a sort.
+    The bases are built in one pass up front; each allocate() is one more pass. """
+    def __init__(self, engine):
+        self.engine = engine
+        # Negative quantities would take freight off other lines; they carry none
+        self.bases = {
+            "volume": array('d', [max(b * c, 0.0) for b, c in zip(engine.ctn, engine.cbm)]),
+            "weight": array('d', [max(b * k, 0.0) for b, k in zip(engine.ctn, engine.kg)]),
+            "value": array('d', [max(r * (b * q), 0.0) for r, b, q in zip(engine.rmb, engine.ctn, engine.qty)]),
+        }
+        self.totals = {basis: math.fsum(weights) for basis, weights in self.bases.items()}
+        # Lines with cartons but no weight (a sheet without G.W, blank cells) would get no freight
+        self.unweighed = sum(1 for b, k in zip(engine.ctn, engine.kg) if b > 0 and k <= 0)
+
+    def available(self):
+        """ The bases this import can be split by; weight needs a weight on every line. """
+        return [basis for basis in ALLOCATION_BASES
+                if self.totals[basis] > 0 and not (basis == "weight" and self.unweighed)]
+
+    def allocate(self, charges, basis="volume"):
+        """ Per-line freight in DA for the invoice `charges` (amounts in DA), in engine order.
+        Raises ValueError when the import has nothing to split by on that basis. """
+        if basis not in self.bases: raise ValueError(f"Unknown allocation basis: {basis}")
+        total = self.totals[basis]
+        if total <= 0: raise ValueError(f"No {basis} to split the freight by in this import")
+        if basis == "weight" and self.unweighed:
+            raise ValueError(f"{self.unweighed:,} of {len(self.engine):,} lines have no weight")
+        cents = round(math.fsum(charges) * ALLOCATION_UNIT)
+        scale = cents / total
+        marks = [round(running * scale) for running in accumulate(self.bases[basis])]
+        marks[-1] = cents  # absorbs the float drift of the running sum
+        return array('d', [(mark - previous) / ALLOCATION_UNIT for mark, previous in zip(marks, [0] + marks[:-1])])
+
+    def apply(self, charges, basis="volume"):
+        """ Re-prices the engine with the allocated freight in place of CBM * shipping rate.
+        The allocation is kept on the engine, so rate changes and watch patches reuse it. """
+        e = self.engine
+        e.freight = self.allocate(charges, basis)
+        e.allocation = (tuple(charges), basis)
+        e.recompute(e.exchange_rate, e.shipping_rate)
+        return e.freight
+
+    def clear(self):
+        """ Back to the per-CBM shipping rate. """
+        e = self.engine
+        e.freight = e.allocation = None
+        e.recompute(e.exchange_rate, e.shipping_rate)
+
+# --- LOGIC ENGINE ---
+HEADER_SCAN_ROWS = 19
+PROGRESS_EVERY = 500  # rows between progress reports / cancel checks
+SHEET_WORKERS = 4
+
+def _cell_text(value):
+    return str(value).strip() if value else ""
+
+def process_excel_preserve_images(filepath, temp_dir=None):
+    try:
+        results, meta = parse_workbook(filepath, temp_dir)
+        if results is None: return None, meta
+        SESSION_STATE.update(meta)
+        return results, "Success"
+
+    except Exception as e:
+        return None, str(e)
+
+def result_record(r, item_name, unit_cost, total_line, rmb_price, boxes_count, units_per_box, image, sheet=""):
+    return {
+        "row_index": r,
+        "name": item_name,
+        "unit_cost": round(unit_cost, 2),
+        "total_line": round(total_line, 2),
+        "rmb_price": rmb_price,
+        "qty": int(boxes_count * units_per_box),
+        "image": image,
+        "sheet": sheet
+    }
+
+def parse_workbook(filepath, temp_dir=None, progress=None, cancel=None):
+    """ Returns (results, meta) where meta holds the SESSION_STATE keys for this file,
+    or (None, error). Touches no global state, so it can run off the UI thread.
+    Every sheet with a packing-list header is imported; header_row/col_map are the first one's.
+    progress(phase, rows, images, results) receives the ResultStore as it fills up.
+    temp_dir holds the thumbnails and parse cache; without one (headless batch runs)
+    images are skipped and nothing is cached. """
+    TRACER.begin("import")
+    # Taken before reading: a save during the import shows up as a change afterwards
+    stamp = file_stamp(filepath)
+    if temp_dir is None:
+        results, meta = _parse_uncached(filepath, None, progress, cancel)
+        if results is not None:
+            meta.update(filepath=filepath, file_stamp=stamp)
+        return results, meta
+
+    if not os.path.exists(temp_dir):
+        os.makedirs(temp_dir)
+
+    # 0. UNCHANGED FILE? Re-cost the cached raw rows, no openpyxl at all
+    cache = ParseCache(os.path.join(temp_dir, PARSE_CACHE_NAME))
+    try:
+        with TRACER.span("import", "cache_lookup") as span:
+            cached = cache.load(filepath)
+            span.set(hit=cached is not None)
+        if cached is not None:
+            with TRACER.span("import", "recost", rows=len(cached[1])):
+                results, meta = _cost_cached_rows(*cached)
+            if progress: progress("rows", len(results), results.image_count(), results)
+        else:
+            results, meta = _parse_uncached(filepath, temp_dir, progress, cancel)
+            if results is not None:
+                with TRACER.span("import", "cache_store", rows=len(results)):
+                    cache.store(filepath, meta["sheets"], results)
+    finally:
+        cache.close()
+
+    if results is not None:
+        meta.update(filepath=filepath, file_stamp=stamp)
+    return results, meta
+
+def _parse_uncached(filepath, temp_dir, progress, cancel):
+    # 1. EXTRACT IMAGES
+    with TRACER.span("import", "images") as span:
+        image_maps = extract_images(filepath, temp_dir, progress, cancel) if temp_dir else {}
+        span.set(images=sum(len(m) for m in image_maps.values()))
+    if cancel is not None and cancel.is_set(): return None, "Cancelled"
+
+    # Read-only mode streams rows from the sheet XML instead of building every cell
+    with TRACER.span("import", "load_workbook"):
+        import openpyxl
+        wb = openpyxl.load_workbook(filepath, read_only=True, data_only=True)
+    try:
+        return _parse_sheets(wb, image_maps, progress, cancel)
+    finally:
+        wb.close()
+
+def _parse_sheets(wb, image_maps, progress, cancel):
+    """ Streams every worksheet, several at once, and merges those with a header in workbook order. """
+    sheets = wb.worksheets
+    if len(sheets) == 1:
+        parsed = [_stream_rows(sheets[0], image_maps.get(sheets[0].title, {}), progress, cancel)]
+    else:
+        # Each sheet fills its own store; finished sheets join `merged` in workbook order,
+        # so progress shows those rows while the rest are still counting
+        merged = ResultStore()
+        counts = {}
+        lock = threading.Lock()
+        images = sum(len(m) for m in image_maps.values())
+
+        def sheet_progress(title):
+            def report(phase, rows, _images, _results):
+                with lock:
+                    counts[title] = rows
+                    total = sum(counts.values())
+                progress(phase, total, images, merged)
+            return report if progress else None
+
+        # Worker threads share the workbook: each sheet reads its own zip member
+        with ThreadPoolExecutor(max_workers=SHEET_WORKERS) as pool:
+            futures = [pool.submit(_stream_rows, sheet, image_maps.get(sheet.title, {}), sheet_progress(sheet.title), cancel)
+                       for sheet in sheets]
+            parsed = []
+            for sheet, future in zip(sheets, futures):
+                part, meta = future.result()
+                parsed.append((part, meta))
+                if part is None or (cancel is not None and cancel.is_set()): continue
+                merged.extend(part, sheet.title)
+                if progress:
+                    with lock:
+                        total = sum(counts.values())
+                    progress("rows", total, images, merged)
+    if cancel is not None and cancel.is_set(): return None, "Cancelled"
+
+    found = [(sheet.title, results, meta) for sheet, (results, meta) in zip(sheets, parsed) if results is not None]
+    if not found: return None, "Header not found."
+    if len(sheets) > 1:
+        results = merged
+    else:
+        results = found[0][1]
+        results.sheets.append(found[0][0])
+    return results, _import_meta(results, [{"name": title, "header_row": meta["header_row"], "col_map": meta["col_map"]}
+                                           for title, _, meta in found])
+
+def _import_meta(results, sheets):
+    return {
+        "header_row": sheets[0]["header_row"],
+        "col_map": sheets[0]["col_map"],
+        "sheets": sheets,
+        "total_investment": results.engine.total_investment,
+        "engine": results.engine,
+    }
+
+def _cost_cached_rows(sheets, rows):
+    results = ResultStore()
+    results.sheets = [sheet["name"] for sheet in sheets]
+    engine = results.engine
+    for sheet_id, r, item_name, rmb_price, boxes_count, units_per_box, cbm_per_box, kg_per_box, image in rows:
+        engine.add_line(rmb_price, boxes_count, units_per_box, cbm_per_box, kg_per_box)
+        results.add(r, item_name, image, sheet_id)
+    return results, _import_meta(results, sheets)
+
+# Gross weight per carton, the way suppliers label it; compared without spaces, dots and brackets
+WEIGHT_HEADERS = ("GW", "GWKG", "GWCTN", "GWKGCTN", "WEIGHT", "WEIGHTKG", "KG", "NW", "NWKG", "NWCTN")
+
+def weight_column(col_map):
+    """ 1-based column of the per-carton weight, preferring gross over net; None without one. """
+    found = {re.sub(r"[\s.()/]", "", str(header)).upper(): col for header, col in col_map.items()}
+    return next((found[key] for key in WEIGHT_HEADERS if key in found), None)
+
+class LineColumns:
+    """ Where a sheet keeps the costing inputs, resolved once from its col_map.
+    line() turns one row of values into a line the same way for the import and the watch. """
+    def __init__(self, col_map):
+        self.name = col_map.get("ITEM", 1) - 1
+        self.alt_name = col_map.get("المنتوج", 1) - 1
+        self.rmb = col_map["Price(RMB)"] - 1 if "Price(RMB)" in col_map else None
+        self.ctn = col_map["Ctn"] - 1 if "Ctn" in col_map else None
+        self.qty = col_map["Qty"] - 1 if "Qty" in col_map else None
+        self.cbm = col_map["CBM"] - 1 if "CBM" in col_map else None
+        self.kg = weight_column(col_map)
+        self.kg = self.kg - 1 if self.kg else None
+        self.used = [idx for idx in (self.name, self.alt_name, self.rmb, self.ctn, self.qty, self.cbm, self.kg) if idx is not None]
+        self.width = max(self.used) + 1
+
+    def line(self, values):
+        """ (item_name, rmb_price, boxes_count, units_per_box, cbm_per_box, kg_per_box), or None for
+        a row without cartons. Raises on values that are not numbers; the import skips those rows. """
+        item_name = str(values[self.name] or "")
+        if item_name == "None" or item_name == "":
+             item_name = str(values[self.alt_name] or "Unknown")
+
+        rmb_price = float((values[self.rmb] if self.rmb is not None else 0) or 0)
+        boxes_count = float((values[self.ctn] if self.ctn is not None else 0) or 0)
+        units_per_box = float((values[self.qty] if self.qty is not None else 0) or 1) 
+        cbm_per_box = float((values[self.cbm] if self.cbm is not None else 0) or 0)
+        kg_per_box = float((values[self.kg] if self.kg is not None else 0) or 0)
+
+        if boxes_count == 0: return None
+        return item_name, rmb_price, boxes_count, units_per_box, cbm_per_box, kg_per_box
+
+    def line_from_xml(self, row_inner, shared):
+        """ line() of one <row> of sheet XML, or None when it has no line or a bad value. """
+        cells = _parse_cells(row_inner)
+        values = [None] * self.width
+        for idx in self.used:
+            cell = cells.get(idx + 1)
+            if cell is not None:
+                values[idx] = _cell_value(*cell, shared)
+        try:
+            return self.line(values)
+        except Exception:
+            return None
+
+def _stream_rows(sheet, image_map, progress=None, cancel=None):
+    """ Header detection and row costing in one forward pass over iter_rows, for one sheet. """
+    header_row_index = -1
+    col_map = {}
+    results = ResultStore()
+    engine = results.engine
+    started = header_found = time.perf_counter()
+    # Read-only mode trusts the <dimension> tag, which some writers leave stale; rows are padded below
+    sheet.reset_dimensions()
+
+    for r, values in enumerate(sheet.iter_rows(values_only=True), start=1):
+        # 2. FIND HEADER
+        if header_row_index == -1:
+            if r > HEADER_SCAN_ROWS: break
+            row_values = [_cell_text(v) for v in values]
+            if "ITEM" in row_values or "Price(RMB)" in row_values:
+                header_row_index = r
+                for idx, val in enumerate(row_values):
+                    col_map[val] = idx + 1 
+
+                # Resolve column positions once instead of per row
+                width = len(row_values)
+                columns = LineColumns(col_map)
+                header_found = time.perf_counter()
+            continue
+
+        # 3. PROCESS ROWS
+        if r % PROGRESS_EVERY == 0:
+            if cancel is not None and cancel.is_set(): return None, "Cancelled"
+            if progress: progress("rows", r - header_row_index, len(image_map), results)
+
+        try:
+            if len(values) < width:
+                values = tuple(values) + (None,) * (width - len(values))
+
+            line = columns.line(values)
+            if line is None: continue
+
+            item_name, rmb_price, boxes_count, units_per_box, cbm_per_box, kg_per_box = line
+            engine.add_line(rmb_price, boxes_count, units_per_box, cbm_per_box, kg_per_box)
+            results.add(r, item_name, image_map.get(r, None))
+
+        except Exception:
+            continue
+
+    if header_row_index == -1: return None, "Header not found."
+    if progress:
+        progress("rows", r - header_row_index, len(image_map), results)
+    if TRACER.enabled:
+        TRACER.record("import", "header_scan", header_found - started, sheet=sheet.title, header_row=header_row_index)
+        TRACER.record("import", "row_loop", time.perf_counter() - header_found, sheet=sheet.title,
+                      rows=r - header_row_index, lines=len(results))
+
+    return results, {
+        "header_row": header_row_index,
+        "col_map": col_map,
+        "total_investment": engine.total_investment,
+        "engine": engine,
+    }
+
+# --- IMAGE CACHE ---
+THUMB_SIZE = 320                       # px, longest side of a cached thumbnail
+THUMB_CACHE_BUDGET = 64 * 1024 * 1024  # bytes kept on disk before LRU eviction
+IMAGE_WORKERS = 4
+
+NS_MAIN = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+NS_REL = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+NS_PKG_REL = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+NS_XDR = "{http://schemas.openxmlformats.org/drawingml/2006/spreadsheetDrawing}"
+NS_A = "{http://schemas.openxmlformats.org/drawingml/2006/main}"
+
+def _read_rels(archive, part):
+    """ rId -> (type, absolute part name) for the .rels file that belongs to `part`. """
+    folder, name = posixpath.split(part)
+    rels_part = posixpath.join(folder, "_rels", name + ".rels")
+    if rels_part not in archive.namelist():
+        return {}
+    rels = {}
+    for rel in ET.fromstring(archive.read(rels_part)).iter(f"{NS_PKG_REL}Relationship"):
+        target = rel.get("Target", "")
+        if target.startswith("/"):
+            target = target[1:]
+        else:
+            target = posixpath.normpath(posixpath.join(folder, target))
+        rels[rel.get("Id")] = (rel.get("Type", ""), target)
+    return rels
+
+def _sheet_parts(archive):
+    """ Sheet name -> worksheet part, in workbook order (chartsheets left out, like wb.worksheets). """
+    book = ET.fromstring(archive.read("xl/workbook.xml"))
+    rels = _read_rels(archive, "xl/workbook.xml")
+    parts = {}
+    for sheet in book.findall(f"{NS_MAIN}sheets/{NS_MAIN}sheet"):
+        rel_type, part = rels.get(sheet.get(f"{NS_REL}id"), ("", None))
+        if part and rel_type.endswith("/worksheet"):
+            parts[sheet.get("name")] = part
+    return parts
+
+def _sheet_image_anchors(archive, sheet_part):
+    """ Yields (row, media part) for every picture anchored on the sheet, in drawing order. """
+    for rel_type, drawing_part in _read_rels(archive, sheet_part).values():
+        if not rel_type.endswith("/drawing"): continue
+        media = _read_rels(archive, drawing_part)
+        drawing = ET.fromstring(archive.read(drawing_part))
+        for anchor in drawing:
+            # twoCellAnchor / oneCellAnchor carry <xdr:from>; absoluteAnchor has no row
+            row_el = anchor.find(f"{NS_XDR}from/{NS_XDR}row")
+            if row_el is None: continue
+            for blip in anchor.iter(f"{NS_A}blip"):
+                rel = media.get(blip.get(f"{NS_REL}embed"))
+                if rel:
+                    yield int(row_el.text) + 1, rel[1]
+
+def _thumbnail(data, thumb_dir, digest=None):
+    """ Stores a downscaled copy under the content hash. Cache hits only touch the file. """
+    digest = digest or hashlib.sha1(data).hexdigest()
+    path = os.path.join(thumb_dir, digest + ".png")
+    if os.path.exists(path):
+        os.utime(path)  # mtime doubles as the LRU clock
+        return path
+    from PIL import Image as PILImage
+    with PILImage.open(io.BytesIO(data)) as img:
+        img.thumbnail((THUMB_SIZE, THUMB_SIZE))
+        if img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA")
+        # A temp name of its own: another import or the watch may be writing the same picture
+        fd, tmp_path = tempfile.mkstemp(dir=thumb_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                img.save(f, "PNG")
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path): os.remove(tmp_path)
+            raise
+    return path
+
+def evict_thumbnails(thumb_dir, budget=THUMB_CACHE_BUDGET, keep=()):
+    """ Drops least recently used thumbnails until the folder fits the disk budget.
+    Paths in `keep` (the import being loaded) stay even when they alone exceed it. """
+    entries = []
+    total = 0
+    for entry in os.scandir(thumb_dir):
+        if not entry.name.endswith(".png"): continue
+        st = entry.stat()
+        total += st.st_size
+        if entry.path not in keep:
+            entries.append((st.st_mtime, st.st_size, entry.path))
+    entries.sort()
+    for _, size, path in entries:
+        if total <= budget: break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
+
+def extract_images(filepath, temp_dir, progress=None, cancel=None):
+    """ Maps sheet name -> {row: cached thumbnail path}, read straight from the xlsx zip. """
+    image_maps = {}
+    thumb_dir = os.path.join(temp_dir, "thumbs")
+    if not os.path.exists(thumb_dir):
+        os.makedirs(thumb_dir)
+        # Older builds left one img_{row}_{idx}.png per picture per import
+        for entry in os.scandir(temp_dir):
+            if entry.name.startswith("img_") and entry.name.endswith(".png"):
+                os.remove(entry.path)
+
+    with zipfile.ZipFile(filepath) as archive:
+        if not any(n.startswith("xl/media/") for n in archive.namelist()):
+            return image_maps
+        anchors = [(title, row, part) for title, sheet_part in _sheet_parts(archive).items()
+                   for row, part in _sheet_image_anchors(archive, sheet_part)]
+        # Each picture is decoded once even if several rows, sheets or duplicated media parts use it
+        digests, blobs = {}, {}
+        for part in {p for _, _, p in anchors}:
+            data = archive.read(part)
+            digests[part] = digest = hashlib.sha1(data).hexdigest()
+            blobs[digest] = data
+
+    with ThreadPoolExecutor(max_workers=IMAGE_WORKERS) as pool:
+        futures = {digest: pool.submit(_thumbnail, data, thumb_dir, digest) for digest, data in blobs.items()}
+        for done, _ in enumerate(as_completed(futures.values()), start=1):
+            if cancel is not None and cancel.is_set():
+                pool.shutdown(wait=True, cancel_futures=True)
+                return image_maps
+            if progress: progress("images", 0, done, None)
+
+    for title, row, part in anchors:
+        try:
+            image_maps.setdefault(title, {})[row] = futures[digests[part]].result()
+        except Exception as e:
+            print(f"Img Error: {e}")
+
+    evict_thumbnails(thumb_dir, keep={path for rows in image_maps.values() for path in rows.values()})
+    return image_maps
+
+# --- PARSE CACHE ---
+PARSE_CACHE_NAME = "parse_cache.sqlite"
+PARSE_CACHE_MAX_ROWS = 300000  # cached lines across all files before LRU eviction
+PARSE_CACHE_VERSION = 3        # bump when the tables change; older caches are dropped
+
+def file_digest(filepath):
+    h = hashlib.sha1()
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+class ParseCache:
+    """ SQLite store of parsed workbooks keyed by path, size, mtime and content hash.
+    Holds each sheet's header position and col_map and the raw costing inputs of every
+    line, so an unchanged file is re-costed at the current rates without being opened. """
+    def __init__(self, db_path):
+        self.db = sqlite3.connect(db_path)
+        if self.db.execute("PRAGMA user_version").fetchone()[0] != PARSE_CACHE_VERSION:
+            self.db.executescript(f"""
+                DROP TABLE IF EXISTS files;
+                DROP TABLE IF EXISTS rows;
+                PRAGMA user_version = {PARSE_CACHE_VERSION};
+            """)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY, size INTEGER, mtime REAL, digest TEXT,
+                sheets TEXT, row_count INTEGER, last_used REAL);
+            CREATE TABLE IF NOT EXISTS rows (
+                path TEXT, seq INTEGER, sheet INTEGER, row_index INTEGER, name TEXT,
+                rmb REAL, ctn REAL, qty REAL, cbm REAL, kg REAL, image TEXT,
+                PRIMARY KEY (path, seq)) WITHOUT ROWID;
+        """)
+
+    def close(self):
+        self.db.close()
+
+    def load(self, filepath):
+        """ (sheets, rows) for an unchanged file, else None. Stale entries are dropped. """
+        path = os.path.abspath(filepath)
+        entry = self.db.execute(
+            "SELECT size, mtime, digest, sheets FROM files WHERE path = ?", (path,)).fetchone()
+        if entry is None: return None
+        size, mtime, digest, sheets = entry
+        st = os.stat(path)
+        if st.st_size != size:
+            self.invalidate(path)
+            return None
+        if st.st_mtime != mtime:
+            # Touched but maybe not edited (copied, re-synced): only the hash decides
+            if file_digest(path) != digest:
+                self.invalidate(path)
+                return None
+            self.db.execute("UPDATE files SET mtime = ? WHERE path = ?", (st.st_mtime, path))
+
+        rows = self.db.execute(
+            "SELECT sheet, row_index, name, rmb, ctn, qty, cbm, kg, image FROM rows WHERE path = ? ORDER BY seq", (path,)).fetchall()
+        # Thumbnails can be evicted independently; re-extract if any went missing
+        images = {row[8] for row in rows if row[8]}
+        if any(not os.path.exists(p) for p in images):
+            self.invalidate(path)
+            return None
+        for p in images:
+            os.utime(p)
+
+        self.db.execute("UPDATE files SET last_used = ? WHERE path = ?", (time.time(), path))
+        self.db.commit()
+        return json.loads(sheets), rows
+
+    def store(self, filepath, sheets, results):
+        path = os.path.abspath(filepath)
+        engine = results.engine
+        st = os.stat(path)
+        with self.db:
+            self.db.execute("DELETE FROM rows WHERE path = ?", (path,))
+            self.db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)",
+                            (path, st.st_size, st.st_mtime, file_digest(path),
+                             json.dumps(sheets, ensure_ascii=False), len(results), time.time()))
+            self.db.executemany(
+                "INSERT INTO rows VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                ((path, seq, sheet_id, r, results.names[name_id], rmb, ctn, qty, cbm, kg, results.images[image_id])
+                 for seq, (sheet_id, r, name_id, image_id, rmb, ctn, qty, cbm, kg) in enumerate(zip(
+                     results.sheet_id, results.row_index, results.name_id, results.image_id,
+                     engine.rmb, engine.ctn, engine.qty, engine.cbm, engine.kg))))
+        self.evict()
+
+    def invalidate(self, path):
+        with self.db:
+            self.db.execute("DELETE FROM rows WHERE path = ?", (path,))
+            self.db.execute("DELETE FROM files WHERE path = ?", (path,))
+
+    def evict(self, max_rows=PARSE_CACHE_MAX_ROWS):
+        """ Drops least recently used files until the cached line count fits the cap. """
+        total = self.db.execute("SELECT COALESCE(SUM(row_count), 0) FROM files").fetchone()[0]
+        for path, row_count in self.db.execute("SELECT path, row_count FROM files ORDER BY last_used").fetchall():
+            if total <= max_rows: break
+            self.invalidate(path)
+            total -= row_count
+
+# --- FILE INDEX ---
+FILE_INDEX_NAME = "file_index.sqlite"
+FILE_INDEX_DEPTH = 8     # folder levels indexed below each root
+FILE_INDEX_SKIP = {"Android", "node_modules", "__pycache__"}  # besides hidden folders
+FILE_INDEX_BATCH = 200   # re-listed folders written per transaction
+RECENT_FILES = 8
+
+def is_workbook_name(name):
+    # Excel lock files (~$name.xlsx) are not workbooks
+    return name.lower().endswith(".xlsx") and not name.startswith("~$")
+
+class FileIndex:
+    """ SQLite list of the .xlsx files under a few root folders, plus the recently used
+    and pinned ones. Adding, removing or renaming a file changes its folder's mtime, so
+    scan() only lists folders whose mtime moved: a rescan of unchanged storage is one
+    stat per folder. Shared between the scan thread and the UI; the lock is only held
+    while a batch of folders is written, never during the walk. """
+    def __init__(self, db_path, roots):
+        self.roots = [os.path.abspath(root) for root in roots]
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS dirs (path TEXT PRIMARY KEY, parent TEXT, mtime REAL);
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY, dir TEXT, name TEXT, size INTEGER, mtime REAL);
+            CREATE INDEX IF NOT EXISTS files_dir ON files (dir);
+            CREATE TABLE IF NOT EXISTS picks (path TEXT PRIMARY KEY, pinned INTEGER, last_used REAL);
+        """)
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def scan(self, cancel=None):
+        """ Brings the index up to date with the disk. Returns how many folders were re-listed. """
+        with self.lock:
+            known, children = {}, {}
+            for path, parent, mtime in self.db.execute("SELECT path, parent, mtime FROM dirs"):
+                known[path] = mtime
+                children.setdefault(parent, []).append(path)
+
+        listed, pending = 0, []
+        stack = [(root, None, 0) for root in self.roots]
+        while stack:
+            if cancel is not None and cancel.is_set(): break
+            path, parent, depth = stack.pop()
+            try:
+                # stat before listing: a change made during the listing shows up next scan
+                mtime = os.stat(path).st_mtime
+                if known.get(path) == mtime:
+                    subdirs = children.get(path, ())
+                else:
+                    subdirs, files = self._list(path, depth < FILE_INDEX_DEPTH)
+                    pending.append((path, parent, mtime, subdirs, files, children.get(path, ())))
+                    listed += 1
+            except OSError:
+                # Deleted, unmounted or not readable (yet: storage permission pending)
+                if path in known: pending.append((path, None, None, (), (), ()))
+                continue
+            stack.extend((sub, path, depth + 1) for sub in subdirs)
+            if len(pending) >= FILE_INDEX_BATCH:
+                self._write(pending)
+                pending = []
+        self._write(pending)
+        return listed
+
+    def _list(self, path, with_dirs):
+        subdirs, files = [], []
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if with_dirs and not entry.name.startswith(".") and entry.name not in FILE_INDEX_SKIP:
+                            subdirs.append(entry.path)
+                    elif is_workbook_name(entry.name) and entry.is_file():
+                        st = entry.stat()
+                        files.append((entry.path, path, entry.name, st.st_size, st.st_mtime))
+                except OSError:
+                    continue
+        return subdirs, files
+
+    def _write(self, folders):
+        """ folders: (path, parent, mtime, subdirs, files, old_subdirs); mtime None = gone. """
+        if not folders: return
+        with self.lock, self.db:
+            for path, parent, mtime, subdirs, files, old_subdirs in folders:
+                if mtime is None:
+                    self._delete_tree(path)
+                    continue
+                self.db.execute("INSERT OR REPLACE INTO dirs VALUES (?, ?, ?)", (path, parent, mtime))
+                self.db.execute("DELETE FROM files WHERE dir = ?", (path,))
+                self.db.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)", files)
+                for gone in set(old_subdirs).difference(subdirs):
+                    self._delete_tree(gone)
+
+    def _delete_tree(self, path):
+        # substr instead of LIKE: folder names may contain % and _
+        prefix = path.rstrip(os.sep) + os.sep
+        self.db.execute("DELETE FROM dirs WHERE path = ? OR substr(path, 1, ?) = ?", (path, len(prefix), prefix))
+        self.db.execute("DELETE FROM files WHERE dir = ? OR substr(dir, 1, ?) = ?", (path, len(prefix), prefix))
+
+    def files(self):
+        """ [(path, size, mtime)] of every indexed workbook, newest first. """
+        with self.lock:
+            return self.db.execute("SELECT path, size, mtime FROM files ORDER BY mtime DESC").fetchall()
+
+    def recent(self, limit=RECENT_FILES):
+        """ Last opened paths that still exist, most recent first. """
+        with self.lock:
+            paths = [row[0] for row in self.db.execute(
+                "SELECT path FROM picks WHERE last_used IS NOT NULL ORDER BY last_used DESC LIMIT ?", (limit * 2,))]
+        return [path for path in paths if os.path.isfile(path)][:limit]
+
+    def pinned(self):
+        with self.lock:
+            paths = [row[0] for row in self.db.execute("SELECT path FROM picks WHERE pinned = 1")]
+        return sorted((path for path in paths if os.path.isfile(path)), key=lambda path: os.path.basename(path).casefold())
+
+    def is_pinned(self, path):
+        with self.lock:
+            row = self.db.execute("SELECT pinned FROM picks WHERE path = ?", (os.path.abspath(path),)).fetchone()
+        return bool(row and row[0])
+
+    def touch(self, path):
+        """ Records that path was just opened. """
+        with self.lock, self.db:
+            self.db.execute("INSERT INTO picks VALUES (?, 0, ?) ON CONFLICT (path) DO UPDATE SET last_used = excluded.last_used",
+                            (os.path.abspath(path), time.time()))
+
+    def pin(self, path, pinned=True):
+        with self.lock, self.db:
+            self.db.execute("INSERT INTO picks VALUES (?, ?, NULL) ON CONFLICT (path) DO UPDATE SET pinned = excluded.pinned",
+                            (os.path.abspath(path), int(pinned)))
+
+# --- HISTORY ---
+HISTORY_NAME = "history.sqlite"
+HISTORY_MAX_LINES = 500000  # stored lines across past imports; older ones keep only their totals
+
+class ImportSnapshot:
+    """ Copies of everything record_import reads from a ResultStore, its engine and its
+    sheets. Taken on the UI thread, so the history worker saves one consistent state while
+    the freight screen, the watch or a rate change keeps editing the live store. """
+    COLUMNS = ("rmb", "ctn", "qty", "cbm", "kg", "unit_cost", "total_line")
+
+    def __init__(self, results, sheets):
+        e = results.engine
+        self.sheet_id = array('i', results.sheet_id)
+        self.row_index = array('i', results.row_index)
+        self.name_id = array('i', results.name_id)
+        self.image_id = array('i', results.image_id)
+        self.names = list(results.names)
+        self.images = list(results.images)
+        for column in self.COLUMNS:
+            setattr(self, column, array('d', getattr(e, column)))
+        self.freight = array('d', e.freight) if e.freight is not None else None
+        self.allocation = e.allocation
+        self.exchange_rate, self.shipping_rate = e.exchange_rate, e.shipping_rate
+        self.total_investment = e.total_investment
+        self.sheets = json.dumps(sheets, ensure_ascii=False)
+
+    def __len__(self):
+        return len(self.rmb)
+
+class HistoryStore:
+    """ SQLite record of dated rates and of every imported file's results. Each import
+    keeps its lines as costed and three rate-free sums: a shipment's total is linear in
+    the rates (ex * goods_rmb + sh * volume_cbm, or + freight once allocated), so one
+    indexed query re-prices every past shipment at today's rates without its file.
+    Written from a worker thread and read by the UI, under one lock. """
+    def __init__(self, db_path):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS rates (at REAL, exchange_rate REAL, shipping_rate REAL);
+            CREATE INDEX IF NOT EXISTS rates_at ON rates (at);
+            CREATE TABLE IF NOT EXISTS imports (
+                id INTEGER PRIMARY KEY, path TEXT UNIQUE, name TEXT, imported_at REAL, updated_at REAL,
+                sheets TEXT, exchange_rate REAL, shipping_rate REAL, allocation TEXT,
+                line_count INTEGER, lines_kept INTEGER, goods_rmb REAL, volume_cbm REAL,
+                freight REAL, units REAL, total_investment REAL,
+                file_size INTEGER, file_mtime REAL, digest TEXT);
+            CREATE INDEX IF NOT EXISTS imports_updated ON imports (updated_at);
+            CREATE TABLE IF NOT EXISTS lines (
+                import_id INTEGER, seq INTEGER, sheet INTEGER, row_index INTEGER, name TEXT,
+                rmb REAL, ctn REAL, qty REAL, cbm REAL, kg REAL, image TEXT,
+                freight REAL, unit_cost REAL, total_line REAL,
+                PRIMARY KEY (import_id, seq)) WITHOUT ROWID;
+        """)
+        # Stores from before the file checks gain the columns; their imports never match a file
+        columns = {row[1] for row in self.db.execute("PRAGMA table_info(imports)")}
+        for column, kind in (("file_size", "INTEGER"), ("file_mtime", "REAL"), ("digest", "TEXT")):
+            if column not in columns:
+                self.db.execute(f"ALTER TABLE imports ADD COLUMN {column} {kind}")
+        self.db.commit()
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    # --- rates ---
+    def record_rates(self, exchange_rate, shipping_rate, at=None):
+        """ Adds a dated entry, unless the rates are the latest ones already. """
+        with self.lock, self.db:
+            if self._latest_rates() == (exchange_rate, shipping_rate): return
+            self.db.execute("INSERT INTO rates VALUES (?, ?, ?)", (time.time() if at is None else at, exchange_rate, shipping_rate))
+
+    def latest_rates(self):
+        """ (exchange_rate, shipping_rate) last saved, or None on a fresh install. """
+        with self.lock:
+            return self._latest_rates()
+
+    def _latest_rates(self):
+        row = self.db.execute("SELECT exchange_rate, shipping_rate FROM rates ORDER BY at DESC LIMIT 1").fetchone()
+        return tuple(row) if row else None
+
+    def rate_history(self, limit=20):
+        """ [(at, exchange_rate, shipping_rate)], newest first. """
+        with self.lock:
+            return self.db.execute("SELECT at, exchange_rate, shipping_rate FROM rates ORDER BY at DESC LIMIT ?", (limit,)).fetchall()
+
+    # --- imports ---
+    def record_import(self, filepath, snapshot, stamp=None):
+        """ Saves one import (an ImportSnapshot) as costed. A file imported again replaces its entry and
+        keeps its id and first import date. `stamp` is the file's (size, mtime) as the
+        results were read from it; the content hash is only taken while the file still
+        has that stamp, so a later edit is never mistaken for this version. Returns the id. """
+        path = os.path.abspath(filepath)
+        stamp = stamp or (None, None)
+        digest = file_digest(path) if stamp[0] is not None and file_stamp(path) == tuple(stamp) else None
+        e = snapshot
+        freight = math.fsum(e.freight) if e.freight is not None else None
+        sums = (math.fsum(r * (b * q) for r, b, q in zip(e.rmb, e.ctn, e.qty)),
+                math.fsum(c * b for c, b in zip(e.cbm, e.ctn)),
+                freight,
+                math.fsum(b * q for b, q in zip(e.ctn, e.qty)))
+        line_freight = e.freight if e.freight is not None else [None] * len(e)
+        now = time.time()
+        with self.lock, self.db:
+            self.db.execute("""
+                INSERT INTO imports (path, name, imported_at, updated_at, sheets, exchange_rate, shipping_rate, allocation,
+                                     line_count, lines_kept, goods_rmb, volume_cbm, freight, units, total_investment,
+                                     file_size, file_mtime, digest)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 1, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (path) DO UPDATE SET
+                    updated_at = excluded.updated_at, sheets = excluded.sheets, exchange_rate = excluded.exchange_rate,
+                    shipping_rate = excluded.shipping_rate, allocation = excluded.allocation, line_count = excluded.line_count,
+                    lines_kept = 1, goods_rmb = excluded.goods_rmb, volume_cbm = excluded.volume_cbm, freight = excluded.freight,
+                    units = excluded.units, total_investment = excluded.total_investment,
+                    file_size = excluded.file_size, file_mtime = excluded.file_mtime, digest = excluded.digest
+            """, (path, os.path.basename(path), now, now, e.sheets, e.exchange_rate, e.shipping_rate,
+                  json.dumps(e.allocation) if e.allocation else None, len(e)) + sums
+                 + (e.total_investment, stamp[0], stamp[1], digest))
+            import_id = self.db.execute("SELECT id FROM imports WHERE path = ?", (path,)).fetchone()[0]
+            self.db.execute("DELETE FROM lines WHERE import_id = ?", (import_id,))
+            self.db.executemany(
+                "INSERT INTO lines VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                ((import_id, seq, sheet_id, r, e.names[name_id], rmb, ctn, qty, cbm, kg, e.images[image_id], f, u, t)
+                 for seq, (sheet_id, r, name_id, image_id, rmb, ctn, qty, cbm, kg, f, u, t) in enumerate(zip(
+                     e.sheet_id, e.row_index, e.name_id, e.image_id,
+                     e.rmb, e.ctn, e.qty, e.cbm, e.kg, line_freight, e.unit_cost, e.total_line))))
+            self._evict()
+        return import_id
+
+    def _evict(self, max_lines=HISTORY_MAX_LINES):
+        # Oldest imports give up their lines first; their totals still re-price
+        kept = self.db.execute("SELECT id, line_count FROM imports WHERE lines_kept = 1 ORDER BY updated_at DESC").fetchall()
+        total = 0
+        for import_id, line_count in kept:
+            total += line_count
+            if total > max_lines:
+                self.db.execute("DELETE FROM lines WHERE import_id = ?", (import_id,))
+                self.db.execute("UPDATE imports SET lines_kept = 0 WHERE id = ?", (import_id,))
+
+    def reprice(self, exchange_rate, shipping_rate, ids=None):
+        """ Every past import (or those in `ids`), newest first, as dicts with the total at
+        its own rates ("total_investment") and at the given ones ("repriced"). """
+        where = f"WHERE id IN ({','.join('?' * len(ids))})" if ids else ""
+        with self.lock:
+            cursor = self.db.execute(f"""
+                SELECT id, path, name, updated_at, line_count, lines_kept, exchange_rate, shipping_rate,
+                       allocation IS NOT NULL AS allocated, units, total_investment,
+                       ? * goods_rmb + COALESCE(freight, ? * volume_cbm) AS repriced
+                FROM imports {where} ORDER BY updated_at DESC
+            """, (exchange_rate, shipping_rate) + tuple(ids or ()))
+            columns = [d[0] for d in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def load(self, import_id):
+        """ (path, sheets, rows, allocation, stamp) of a past import, rows shaped like
+        ParseCache.load's, or None when its lines are no longer kept. `path` is None unless
+        the file there is still the one these lines were read from, and `stamp` is then its
+        current (size, mtime): exporting or watching an edited file by stale row numbers
+        would corrupt it. """
+        with self.lock:
+            entry = self.db.execute(
+                "SELECT path, sheets, allocation, lines_kept, file_size, file_mtime, digest FROM imports WHERE id = ?",
+                (import_id,)).fetchone()
+            if entry is None or not entry[3]: return None
+            rows = self.db.execute(
+                "SELECT sheet, row_index, name, rmb, ctn, qty, cbm, kg, image FROM lines WHERE import_id = ? ORDER BY seq",
+                (import_id,)).fetchall()
+        path, sheets, allocation, _, size, mtime, digest = entry
+        if allocation:
+            charges, basis = json.loads(allocation)
+            allocation = (tuple(charges), basis)
+        stamp = file_stamp(path)
+        # Same size and mtime, or touched (copied, re-synced) but with the same content
+        unchanged = stamp is not None and digest is not None and stamp[0] == size and (
+            stamp[1] == mtime or file_digest(path) == digest)
+        return (path if unchanged else None), json.loads(sheets), rows, allocation, (stamp if unchanged else None)
+
+    def forget(self, import_id):
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM lines WHERE import_id = ?", (import_id,))
+            self.db.execute("DELETE FROM imports WHERE id = ?", (import_id,))
+
+def open_past_import(history, import_id):
+    """ (results, meta) of a past import re-costed at the current rates from its stored
+    lines, its freight allocation split again; (None, error) when it is gone. """
+    loaded = history.load(import_id)
+    if loaded is None: return None, "The lines of this import are no longer kept"
+    path, sheets, rows, allocation, stamp = loaded
+    results, meta = _cost_cached_rows(sheets, rows)
+    if allocation:
+        FreightAllocator(results.engine).apply(*allocation)
+        meta["total_investment"] = results.engine.total_investment
+    # Without its unchanged file, export writes the report from the stored lines and watch stays off
+    meta.update(filepath=path, file_stamp=stamp, history_id=import_id)
+    return results, meta
+
+def write_history_csv(rows, path, exchange_rate, shipping_rate):
+    """ The reprice() table: each past import at its own rates and at the given ones. """
+    with open(path, "w", newline="", encoding="utf-8-sig") as f:
+        writer = csv.writer(f)
+        writer.writerow(["File", "Updated", "Lines", "Exchange", "Shipping (DA/CBM)", "Freight allocated",
+                         "Total (DA)", f"At {exchange_rate:g} / {shipping_rate:g} (DA)", "Change (DA)"])
+        for row in rows:
+            writer.writerow([row["path"], time.strftime("%Y-%m-%d %H:%M", time.localtime(row["updated_at"])), row["line_count"],
+                             row["exchange_rate"], row["shipping_rate"], "yes" if row["allocated"] else "",
+                             round(row["total_investment"], 2), round(row["repriced"], 2),
+                             round(row["repriced"] - row["total_investment"], 2)])
+
+# --- WATCH ---
+WATCH_INTERVAL = 2  # seconds between checks of the imported file
+WATCH_PARTS = ("xl/worksheets/", "xl/drawings/", "xl/media/")  # must be unchanged, imported sheets aside
+REIMPORT = "reimport"
+ROW_NUMBER_RE = re.compile(r'\br="(\d+)"')
+
+def file_stamp(filepath):
+    """ (size, mtime), or None when the file is missing. """
+    try:
+        st = os.stat(filepath)
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime
+
+class WorkbookWatch:
+    """ Follows an imported workbook on disk and turns a save into line changes.
+    Only the imported sheets' XML is read again. Rows whose XML is byte-identical to the
+    last check are skipped; the others are decoded with the import's col_map and compared
+    with the loaded lines. Edits that move the layout (header rows, other sheets, pictures,
+    the sheet list) cannot be patched, and check() returns REIMPORT. """
+    def __init__(self, results, filepath, sheets, stamp, temp_dir=None):
+        self.results = results
+        self.filepath = filepath
+        self.sheets = sheets
+        self.stamp = stamp  # the file as imported
+        self.temp_dir = temp_dir
+        self.baseline = None  # (layout, shared strings CRC, [{row: hash of its XML}]) of self.stamp
+        self.patchable = True  # False when the sheet XML is beyond the reader: every save re-imports
+
+    def check(self):
+        """ None when nothing changed, REIMPORT, or {(sheet_id, row): line or None} for the
+        lines edited, added or removed (None), in the form ResultStore.apply takes. """
+        stamp = file_stamp(self.filepath)
+        if stamp is None or (stamp == self.stamp and (self.baseline is not None or not self.patchable)): return None
+        if stamp != self.stamp and (self.baseline is None or not self.patchable): return REIMPORT
+        try:
+            with zipfile.ZipFile(self.filepath) as archive:
+                changes = self._diff(archive)
+        except (zipfile.BadZipFile, EOFError):
+            return None  # caught mid-save; the next check reads the finished file
+        except (KeyError, ValueError, UnsupportedLayout, ET.ParseError):
+            if self.baseline is None:
+                self.patchable = False
+                return None
+            return REIMPORT
+        if changes is not REIMPORT: self.stamp = stamp
+        return changes or None
+
+    def _diff(self, archive):
+        parts = _sheet_parts(archive)
+        imported = [parts.get(sheet["name"]) for sheet in self.sheets]
+        if None in imported: return REIMPORT
+        crcs = {info.filename: info.CRC for info in archive.infolist()}
+        layout = (parts, {name: crc for name, crc in crcs.items() if name.startswith(WATCH_PARTS) and name not in imported})
+        shared_crc = crcs.get("xl/sharedStrings.xml")
+
+        sheet_rows = []
+        for part in imported:
+            rows = {}
+            for m in ROW_RE.finditer(archive.read(part).decode("utf-8")):
+                number = ROW_NUMBER_RE.search(m.group(1))
+                if number is None: raise UnsupportedLayout("row without r attribute")
+                rows[int(number.group(1))] = m
+            sheet_rows.append(rows)
+        hashes = [{r: hash(m.group(0)) for r, m in rows.items()} for rows in sheet_rows]
+
+        first = self.baseline is None
+        old_layout, old_shared_crc, old_hashes = self.baseline or (layout, shared_crc, hashes)
+        self.baseline = (layout, shared_crc, hashes)
+        if first: return None
+        if layout != old_layout: return REIMPORT
+
+        results = self.results
+        positions = {key: i for i, key in enumerate(zip(results.sheet_id, results.row_index))}
+        shared = None
+        changes = {}
+        for sheet_id, (sheet, rows, new, old) in enumerate(zip(self.sheets, sheet_rows, hashes, old_hashes)):
+            h_row = sheet["header_row"]
+            touched = {r for r in new.keys() | old.keys() if new.get(r) != old.get(r)}
+            if any(r <= h_row for r in touched): return REIMPORT
+            if shared_crc != old_shared_crc:
+                # Shared string ids may have moved: identical XML can mean different text
+                touched = {r for r in new.keys() | old.keys() if r > h_row}
+            if not touched: continue
+            if shared is None: shared = _read_shared_strings(archive)
+
+            columns = LineColumns(sheet["col_map"])
+            added = []
+            for r in touched:
+                line = columns.line_from_xml(rows[r].group(2), shared) if r in rows else None
+                i = positions.get((sheet_id, r))
+                current = results.line(i) if i is not None else None
+                if line is None:
+                    if current is not None: changes[sheet_id, r] = None
+                elif current is None:
+                    added.append(r)
+                    changes[sheet_id, r] = line + (None,)
+                elif line != current[:6]:
+                    changes[sheet_id, r] = line + (current[6],)
+            if added and self.temp_dir:
+                self._add_images(archive, imported[sheet_id], sheet_id, added, changes)
+        return changes
+
+    def _add_images(self, archive, sheet_part, sheet_id, rows, changes):
+        """ Pictures of newly added lines; the drawings are unchanged, so the thumbnails are cached. """
+        anchors = dict(_sheet_image_anchors(archive, sheet_part))
+        thumb_dir = os.path.join(self.temp_dir, "thumbs")
+        for r in rows:
+            if r in anchors:
+                changes[sheet_id, r] = changes[sheet_id, r][:6] + (_thumbnail(archive.read(anchors[r]), thumb_dir),)
+
+# --- SEARCH ---
+# Arabic: drop harakat/tatweel and fold letter variants so "منتج" matches "مُنتَج"
+SEARCH_FOLD = dict.fromkeys(list(range(0x064B, 0x0653)) + [0x0640, 0x0670])
+SEARCH_FOLD.update({ord('أ'): 'ا', ord('إ'): 'ا', ord('آ'): 'ا', ord('ى'): 'ي', ord('ة'): 'ه'})
+
+def normalize_search(text):
+    return text.casefold().translate(SEARCH_FOLD)
+
+class SearchIndex:
+    """ Trigram index over item names (one per row), built once per import.
+    A query that contains the previous one only re-checks the previous hits. """
+    def __init__(self, names):
+        folded = {}
+        self.keys = [folded.get(name) or folded.setdefault(name, normalize_search(name)) for name in names]
+        self.grams = {}
+        for i, key in enumerate(self.keys):
+            for gram in {key[j:j+3] for j in range(len(key) - 2)}:
+                self.grams.setdefault(gram, []).append(i)
+        self.last_query = ""
+        self.last_hits = None
+
+    def search(self, query):
+        """ Row positions whose name contains `query`, in sheet order. None means no filter. """
+        query = normalize_search(query)
+        keys = self.keys
+        if not query:
+            hits = None
+        elif self.last_hits is not None and self.last_query in query:
+            hits = [i for i in self.last_hits if query in keys[i]]
+        elif len(query) >= 3:
+            # Every hit contains each trigram of the query: scan only the rarest one's postings
+            rarest = min((self.grams.get(query[j:j+3], ()) for j in range(len(query) - 2)), key=len)
+            hits = [i for i in rarest if query in keys[i]]
+        else:
+            hits = [i for i, key in enumerate(keys) if query in key]
+        self.last_query, self.last_hits = query, hits
+        return hits
+
+# --- XLSX PATCH EXPORT ---
+# The export only changes two columns and a few styles, so it rewrites the
+# active sheet XML and styles.xml in place and copies every other zip entry
+# (drawings, media, shared strings) unchanged.
+ROW_RE = re.compile(r'<row\b([^>]*?)(?:/>|>(.*?)</row>)', re.S)
+CELL_RE = re.compile(r'<c\b([^>]*?)(?:/>|>(.*?)</c>)', re.S)
+ATTR_RE = re.compile(r'([\w:]+)="([^"]*)"')
+FORMULA_RE = re.compile(r'<f\b[^>]*?(?:/>|>.*?</f>)', re.S)
+CELL_REF_RE = re.compile(r'<c\b[^>]*?\br="([A-Z]+)\d+"')
+
+BOLD_WHITE_FONT = '<font><b/><color rgb="00FFFFFF"/></font>'
+BOLD_FONT = '<font><b/></font>'
+NAVY_FILL = '<fill><patternFill patternType="solid"><fgColor rgb="00000080"/><bgColor rgb="00000080"/></patternFill></fill>'
+THIN_BORDER = '<border><left style="thin"/><right style="thin"/><top style="thin"/><bottom style="thin"/></border>'
+CENTER = '<alignment horizontal="center"/>'
+
+class UnsupportedLayout(Exception):
+    """ The sheet XML uses a form the patcher does not handle; export falls back to openpyxl. """
+
+def col_letter(col):
+    letters = ""
+    while col:
+        col, rem = divmod(col - 1, 26)
+        letters = chr(65 + rem) + letters
+    return letters
+
+def col_index(letters):
+    col = 0
+    for ch in letters:
+        col = col * 26 + ord(ch) - 64
+    return col
+
+def _attrs(text):
+    return dict(ATTR_RE.findall(text))
+
+def _render_attrs(attrs):
+    return "".join(f' {k}="{v}"' for k, v in attrs.items())
+
+# Same as xml.sax.saxutils, which imports urllib.request and http.client on the way in
+def xml_escape(text):
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+def xml_unescape(text):
+    return text.replace("&lt;", "<").replace("&gt;", ">").replace("&amp;", "&")
+
+def _inline_str(text):
+    return f'<is><t xml:space="preserve">{xml_escape(str(text))}</t></is>'
+
+class StyleBook:
+    """ Appends fonts/fills/borders and derived cellXfs entries to styles.xml.
+    Like openpyxl, setting a font/fill/border/alignment replaces that part of the cell's xf. """
+    def __init__(self, xml):
+        self.xml = xml
+        self.added = {"fonts": [], "fills": [], "borders": [], "cellXfs": []}
+        self.counts = {}
+        self.xfs = None
+        for tag, child in (("fonts", "font"), ("fills", "fill"), ("borders", "border"), ("cellXfs", "xf")):
+            m = re.search(rf'<{tag}\b[^>]*>(.*?)</{tag}>', xml, re.S)
+            if not m: raise UnsupportedLayout(f"styles.xml has no <{tag}>")
+            items = re.findall(rf'<{child}\b[^>]*?(?:/>|>.*?</{child}>)', m.group(1), re.S)
+            self.counts[tag] = len(items)
+            if tag == "cellXfs": self.xfs = items
+        self.part_ids = {}
+        self.derived = {}
+
+    def _part(self, tag, part_xml):
+        if part_xml not in self.part_ids:
+            self.part_ids[part_xml] = self.counts[tag] + len(self.added[tag])
+            self.added[tag].append(part_xml)
+        return self.part_ids[part_xml]
+
+    def derive(self, base, font=None, fill=None, border=None, alignment=None):
+        """ Index of a cellXfs entry equal to xf `base` with the given parts swapped in. """
+        key = (base, font, fill, border, alignment)
+        if key in self.derived: return self.derived[key]
+        xf = self.xfs[base] if base < len(self.xfs) else self.xfs[0]
+        m = re.match(r'<xf\b([^>]*?)(?:/>|>(.*?)</xf>)', xf, re.S)
+        attrs, inner = _attrs(m.group(1)), m.group(2) or ""
+        if font:
+            attrs["fontId"] = str(self._part("fonts", font)); attrs["applyFont"] = "1"
+        if fill:
+            attrs["fillId"] = str(self._part("fills", fill)); attrs["applyFill"] = "1"
+        if border:
+            attrs["borderId"] = str(self._part("borders", border)); attrs["applyBorder"] = "1"
+        if alignment:
+            inner = alignment + re.sub(r'<alignment\b[^>]*?(?:/>|>.*?</alignment>)', "", inner, flags=re.S)
+            attrs["applyAlignment"] = "1"
+        self.derived[key] = self.counts["cellXfs"] + len(self.added["cellXfs"])
+        self.added["cellXfs"].append(f"<xf{_render_attrs(attrs)}>{inner}</xf>")
+        return self.derived[key]
+
+    def render(self):
+        xml = self.xml
+        for tag, items in self.added.items():
+            if not items: continue
+            m = re.search(rf'<{tag}\b([^>]*)>(.*?)</{tag}>', xml, re.S)
+            attrs = _attrs(m.group(1))
+            attrs["count"] = str(self.counts[tag] + len(items))
+            block = f"<{tag}{_render_attrs(attrs)}>{m.group(2)}{''.join(items)}</{tag}>"
+            xml = xml[:m.start()] + block + xml[m.end():]
+        return xml
+
+def _read_shared_strings(archive):
+    if "xl/sharedStrings.xml" not in archive.namelist(): return []
+    root = ET.fromstring(archive.read("xl/sharedStrings.xml"))
+    return ["".join(t.text or "" for t in si.iter(f"{NS_MAIN}t")) for si in root.iter(f"{NS_MAIN}si")]
+
+def _parse_cells(row_inner):
+    """ col -> (attrs, inner) for one <row>. """
+    cells = {}
+    for m in CELL_RE.finditer(row_inner or ""):
+        attrs = _attrs(m.group(1))
+        ref = attrs.get("r")
+        if not ref: raise UnsupportedLayout("cell without r attribute")
+        cells[col_index(ref.rstrip("0123456789"))] = (attrs, m.group(2) or "")
+    return cells
+
+def _cell_text_value(attrs, inner, shared):
+    t = attrs.get("t", "n")
+    if t == "inlineStr":
+        return xml_unescape("".join(re.findall(r'<t\b[^>]*>(.*?)</t>', inner, re.S)))
+    m = re.search(r'<v>(.*?)</v>', inner, re.S)
+    if not m: return None
+    if t == "s": return shared[int(m.group(1))]
+    return xml_unescape(m.group(1))
+
+def _cell_value(attrs, inner, shared):
+    """ A cell as openpyxl's values_only reads it: numbers as int or float, booleans as bool. """
+    value = _cell_text_value(attrs, inner, shared)
+    t = attrs.get("t", "n")
+    if value is None or t not in ("n", "b"): return value
+    if t == "b": return value == "1"
+    return float(value) if "." in value or "e" in value or "E" in value else int(value)
+
+def _patch_sheet(sheet_xml, styles, shared, h_row, col_map, unit_costs):
+    """ One worksheet's XML with the Ctn/Total columns rewritten; styles are added to `styles`. """
+    # 1. IDENTIFY COLUMNS (same rules as the openpyxl path)
+    max_col = max((col_index(c) for c in CELL_REF_RE.findall(sheet_xml)), default=0)
+    header = None
+    for m in ROW_RE.finditer(sheet_xml):
+        if int(_attrs(m.group(1)).get("r", 0)) == h_row:
+            header = _parse_cells(m.group(2))
+            break
+    if header is None: raise UnsupportedLayout("header row not found")
+
+    ctn_col = None
+    total_col = None
+    for col in sorted(header):
+        val = str(_cell_text_value(*header[col], shared)).strip().lower()
+        if val in ["ctn", "carton", "box", "boxes", "qty (ctn)"]:
+            ctn_col = col
+        elif "total" in val or "amount" in val:
+            total_col = col
+    if not total_col: total_col = max_col + 1
+    if not ctn_col: ctn_col = col_map.get("Ctn")
+    if not ctn_col: raise UnsupportedLayout("no Ctn column")
+
+    ctn_letter, total_letter = col_letter(ctn_col), col_letter(total_col)
+
+    def style_of(cells, col):
+        return int(cells[col][0].get("s", 0)) if col in cells else 0
+
+    def patch_row(m):
+        row_attrs = _attrs(m.group(1))
+        r = int(row_attrs.get("r", 0))
+        if r < h_row: return m.group(0)
+        cells = _parse_cells(m.group(2))
+
+        if r == h_row:
+            # 2. HEADERS: Total -> "Ctn", Ctn -> "Unit Cost (DZD)"
+            s = styles.derive(style_of(cells, total_col), font=BOLD_WHITE_FONT, alignment=CENTER)
+            cells[total_col] = ({"r": f"{total_letter}{r}", "s": str(s), "t": "inlineStr"}, _inline_str("Ctn"))
+            s = styles.derive(style_of(cells, ctn_col), font=BOLD_WHITE_FONT, fill=NAVY_FILL, alignment=CENTER)
+            cells[ctn_col] = ({"r": f"{ctn_letter}{r}", "s": str(s), "t": "inlineStr"}, _inline_str("Unit Cost (DZD)"))
+        else:
+            # Move the original Ctn value (cached value, not formula) into the Total column
+            s = styles.derive(style_of(cells, total_col), border=THIN_BORDER, alignment=CENTER)
+            moved = {"r": f"{total_letter}{r}", "s": str(s)}
+            inner = ""
+            if ctn_col in cells:
+                src_attrs, src_inner = cells[ctn_col]
+                t = src_attrs.get("t")
+                inner = FORMULA_RE.sub("", src_inner)
+                if t == "str":
+                    value = _cell_text_value({"t": "str"}, inner, shared)
+                    t, inner = "inlineStr", _inline_str(value or "")
+                if t and "<" in inner: moved["t"] = t
+            cells[total_col] = (moved, inner)
+
+            # 3. OVERWRITE CTN COLUMN WITH PRICE
+            if r in unit_costs:
+                s = styles.derive(style_of(cells, ctn_col), font=BOLD_FONT, border=THIN_BORDER, alignment=CENTER)
+                cells[ctn_col] = ({"r": f"{ctn_letter}{r}", "s": str(s)}, f"<v>{repr(float(unit_costs[r]))}</v>")
+
+        row_attrs.pop("spans", None)
+        body = "".join(f"<c{_render_attrs(a)}>{inner}</c>" if inner else f"<c{_render_attrs(a)}/>"
+                       for _, (a, inner) in sorted(cells.items()))
+        return f"<row{_render_attrs(row_attrs)}>{body}</row>"
+
+    sheet_xml = ROW_RE.sub(patch_row, sheet_xml)
+    if total_col > max_col:
+        sheet_xml = re.sub(r'(<dimension ref="[A-Z]+\d+:)[A-Z]+(\d+)"',
+                           lambda m: f'{m.group(1)}{total_letter}{m.group(2)}"', sheet_xml, count=1)
+    return sheet_xml
+
+def patch_export(filepath, output_name, data, sheets):
+    """ Writes the costed copy of `filepath` with every imported sheet patched.
+    Raises UnsupportedLayout when a sheet can't be patched. """
+    with zipfile.ZipFile(filepath) as archive:
+        read_span = TRACER.span("export", "read_parts")
+        with read_span:
+            names = archive.namelist()
+            if "xl/styles.xml" not in names: raise UnsupportedLayout("missing styles part")
+            parts = _sheet_parts(archive)
+            sheet_xmls = {}
+            for sheet in sheets:
+                part = parts.get(sheet["name"])
+                if not part or part not in names: raise UnsupportedLayout(f"missing sheet {sheet['name']}")
+                sheet_xmls[part] = archive.read(part).decode("utf-8")
+                if "<sheetData" not in sheet_xmls[part]: raise UnsupportedLayout("prefixed sheet XML")
+            styles = StyleBook(archive.read("xl/styles.xml").decode("utf-8"))
+            shared = _read_shared_strings(archive)
+            read_span.set(sheets=len(sheets), sheet_kb=sum(len(x) for x in sheet_xmls.values()) // 1024)
+
+        replaced = {}
+        for sheet_id, sheet in enumerate(sheets):
+            part = parts[sheet["name"]]
+            unit_costs = data.unit_costs_by_row(sheet_id)
+            with TRACER.span("export", "patch_rows", sheet=sheet["name"], lines=len(unit_costs)):
+                replaced[part] = _patch_sheet(sheet_xmls[part], styles, shared, sheet["header_row"],
+                                              sheet["col_map"], unit_costs).encode("utf-8")
+        replaced["xl/styles.xml"] = styles.render().encode("utf-8")
+
+        # calcChain lists formula cells; the Total column formulas are gone, let Excel rebuild it
+        if "xl/calcChain.xml" in names:
+            ct = archive.read("[Content_Types].xml").decode("utf-8")
+            replaced["[Content_Types].xml"] = re.sub(r'<Override[^>]*PartName="/xl/calcChain.xml"[^>]*/>', "", ct).encode("utf-8")
+            rels = archive.read("xl/_rels/workbook.xml.rels").decode("utf-8")
+            replaced["xl/_rels/workbook.xml.rels"] = re.sub(r'<Relationship[^>]*Target="[^"]*calcChain.xml"[^>]*/>', "", rels).encode("utf-8")
+
+        tmp_name = output_name + ".tmp"
+        with TRACER.span("export", "write_zip", entries=len(names)), zipfile.ZipFile(tmp_name, "w") as out:
+            for info in archive.infolist():
+                if info.filename == "xl/calcChain.xml": continue
+                data_bytes = replaced.get(info.filename)
+                out.writestr(info, archive.read(info) if data_bytes is None else data_bytes)
+    os.replace(tmp_name, output_name)
+
+def export_output_path(prefix="CostSheet", extension="xlsx"):
+    timestamp = int(time.time())
+    if IS_ANDROID:
+        return f"/storage/emulated/0/Download/{prefix}_{timestamp}.{extension}"
+    return os.path.join(os.path.expanduser("~"), "Downloads", f"{prefix}_{timestamp}.{extension}")
+
+def export_results_smart():
+    data = SESSION_STATE["data"]
+    filepath = SESSION_STATE["filepath"]
+    
+    if not data: return False, "No data"
+    # A past import whose workbook is gone or edited since: its stored lines only
+    if not filepath: return export_report("xlsx")
+
+    try:
+        TRACER.begin("export")
+        output_name = export_output_path()
+        try:
+            patch_export(filepath, output_name, data, SESSION_STATE["sheets"])
+        except UnsupportedLayout as e:
+            print(f"Patch export skipped: {e}")
+            export_with_openpyxl(filepath, output_name, data, SESSION_STATE["sheets"])
+        return True, output_name
+
+    except Exception as e:
+        return False, str(e)
+
+# --- REPORT EXPORT ---
+# A clean listing of the costed lines, independent of the supplier's layout. Rows go
+# from the ResultStore columns into the zip stream in chunks, so memory stays flat
+# however long the shipment is, and every cell uses one of a few shared styles.
+REPORT_HEADERS = ["Sheet", "Row", "Product", "Price (RMB)", "Qty", "Unit cost (DA)", "Line total (DA)", "Image"]
+REPORT_WIDTHS = [16, 8, 40, 12, 10, 16, 18, 46]
+REPORT_CHUNK = 2000  # rows per write to the zip stream
+REPORT_COMPRESSLEVEL = 1  # deflate level; half the time of the default for a file about 25% larger
+# cellXfs: 0 default, 1 header, 2 money, 3 count, 4 bold money, 5 bold text; numFmt 3/4 are Excel's built-in #,##0 and #,##0.00
+REPORT_STYLES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    f'<fonts count="3"><font><sz val="11"/><name val="Calibri"/></font>{BOLD_WHITE_FONT}{BOLD_FONT}</fonts>'
+    f'<fills count="3"><fill><patternFill patternType="none"/></fill><fill><patternFill patternType="gray125"/></fill>{NAVY_FILL}</fills>'
+    f'<borders count="2"><border><left/><right/><top/><bottom/><diagonal/></border>{THIN_BORDER}</borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="6"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    f'<xf numFmtId="0" fontId="1" fillId="2" borderId="1" xfId="0" applyFont="1" applyFill="1" applyBorder="1" applyAlignment="1">{CENTER}</xf>'
+    '<xf numFmtId="4" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+    '<xf numFmtId="3" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+    '<xf numFmtId="4" fontId="2" fillId="0" borderId="0" xfId="0" applyNumberFormat="1" applyFont="1"/>'
+    '<xf numFmtId="0" fontId="2" fillId="0" borderId="0" xfId="0" applyFont="1"/></cellXfs>'
+    '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+    '</styleSheet>')
+REPORT_PARTS = {
+    "[Content_Types].xml":
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '<Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+        '</Types>',
+    "_rels/.rels":
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+        '</Relationships>',
+    "xl/workbook.xml":
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Cost Report" sheetId="1" r:id="rId1"/></sheets></workbook>',
+    "xl/_rels/workbook.xml.rels":
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+        '<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>'
+        '</Relationships>',
+    "xl/styles.xml": REPORT_STYLES,
+}
+
+def report_rows(data):
+    """ (sheet, row, product, RMB, qty, unit cost, line total, image file) per line, straight from the columns. """
+    e = data.engine
+    sheets = data.sheets or [""]
+    names = data.names
+    images = [os.path.basename(path) if path else "" for path in data.images]
+    for s, r, n, im, rmb, ctn, qty, unit_cost, total_line in zip(
+            data.sheet_id, data.row_index, data.name_id, data.image_id, e.rmb, e.ctn, e.qty, e.unit_cost, e.total_line):
+        yield sheets[s], r, names[n], rmb, int(ctn * qty), round(unit_cost, 2), round(total_line, 2), images[im]
+
+def write_report_csv(data, output_name):
+    # utf-8-sig so Excel shows Arabic product names correctly
+    with open(output_name, "w", newline="", encoding="utf-8-sig", buffering=1 << 16) as f:
+        writer = csv.writer(f)
+        writer.writerow(REPORT_HEADERS)
+        writer.writerows(report_rows(data))
+
+def write_report_xlsx(data, output_name):
+    """ One-sheet workbook: header, one row per line, and a TOTAL row with live SUM formulas. """
+    e = data.engine
+    last = len(data) + 1
+    # Names, sheets and pictures are interned: each distinct one is escaped once
+    sheets = [_inline_str(name) for name in data.sheets or [""]]
+    names = [_inline_str(name) for name in data.names]
+    images = [_inline_str(os.path.basename(path) if path else "") for path in data.images]
+    cols = "".join(f'<col min="{i}" max="{i}" width="{w}" customWidth="1"/>' for i, w in enumerate(REPORT_WIDTHS, start=1))
+    head = "".join(f'<c r="{col_letter(i)}1" s="1" t="inlineStr">{_inline_str(h)}</c>' for i, h in enumerate(REPORT_HEADERS, start=1))
+
+    tmp_name = output_name + ".tmp"
+    with zipfile.ZipFile(tmp_name, "w", zipfile.ZIP_DEFLATED, compresslevel=REPORT_COMPRESSLEVEL) as out:
+        for part, xml in REPORT_PARTS.items():
+            out.writestr(part, xml)
+        with out.open("xl/worksheets/sheet1.xml", "w", force_zip64=True) as f:
+            f.write(('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                     '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                     '<sheetViews><sheetView workbookViewId="0"><pane ySplit="1" topLeftCell="A2" activePane="bottomLeft" state="frozen"/>'
+                     f'</sheetView></sheetViews><cols>{cols}</cols><sheetData><row r="1">{head}</row>').encode("utf-8"))
+            chunk = []
+            for n, (s, r, name_id, image_id, rmb, ctn, qty, unit_cost, total_line) in enumerate(zip(
+                    data.sheet_id, data.row_index, data.name_id, data.image_id, e.rmb, e.ctn, e.qty, e.unit_cost, e.total_line), start=2):
+                chunk.append(f'<row r="{n}"><c r="A{n}" t="inlineStr">{sheets[s]}</c><c r="B{n}"><v>{r}</v></c>'
+                             f'<c r="C{n}" t="inlineStr">{names[name_id]}</c><c r="D{n}" s="2"><v>{rmb!r}</v></c>'
+                             f'<c r="E{n}" s="3"><v>{int(ctn * qty)}</v></c><c r="F{n}" s="2"><v>{round(unit_cost, 2)!r}</v></c>'
+                             f'<c r="G{n}" s="2"><v>{round(total_line, 2)!r}</v></c><c r="H{n}" t="inlineStr">{images[image_id]}</c></row>')
+                if len(chunk) >= REPORT_CHUNK:
+                    f.write("".join(chunk).encode("utf-8"))
+                    chunk = []
+            t = last + 1
+            total_qty = sum(int(b * q) for b, q in zip(e.ctn, e.qty))
+            chunk.append(f'<row r="{t}"><c r="C{t}" s="5" t="inlineStr">{_inline_str("TOTAL")}</c>'
+                         f'<c r="E{t}" s="3"><f>SUM(E2:E{last})</f><v>{total_qty}</v></c>'
+                         f'<c r="G{t}" s="4"><f>SUM(G2:G{last})</f><v>{round(e.total_investment, 2)!r}</v></c></row>')
+            f.write(("".join(chunk) + "</sheetData></worksheet>").encode("utf-8"))
+    os.replace(tmp_name, output_name)
+
+def export_report(extension="xlsx"):
+    """ Report of the loaded import, as .xlsx or .csv. Returns (ok, path or error) like export_results_smart. """
+    data = SESSION_STATE["data"]
+    if not data: return False, "No data"
+
+    try:
+        TRACER.begin("export")
+        output_name = export_output_path("CostReport", extension)
+        with TRACER.span("export", "report", lines=len(data), format=extension):
+            (write_report_csv if extension == "csv" else write_report_xlsx)(data, output_name)
+        return True, output_name
+
+    except Exception as e:
+        return False, str(e)
+
+def export_with_openpyxl(filepath, output_name, data, sheets):
+    """ Full load/save path, kept for sheets the XML patcher can't handle. Drops images. """
+    with TRACER.span("export", "openpyxl_load"):
+        import openpyxl
+        wb = openpyxl.load_workbook(filepath)
+    for sheet_id, info in enumerate(sheets):
+        _cost_sheet_openpyxl(wb[info["name"]], info["header_row"], info["col_map"], data.unit_costs_by_row(sheet_id))
+
+    with TRACER.span("export", "openpyxl_save", lines=len(data)):
+        wb.save(output_name)
+
+def _cost_sheet_openpyxl(sheet, h_row, col_map, unit_costs):
+    from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
+    bold_font = Font(bold=True, color="FFFFFF")
+    fill = PatternFill(start_color="000080", end_color="000080", fill_type="solid")
+    thin_border = Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin'))
+
+    # 1. IDENTIFY COLUMNS
+    ctn_col = None
+    total_col = None
+    
+    # Scan headers to find Ctn and Total
+    for cell in sheet[h_row]:
+        val = str(cell.value).strip().lower()
+        if val in ["ctn", "carton", "box", "boxes", "qty (ctn)"]:
+            ctn_col = cell.column
+        elif "total" in val or "amount" in val:
+            total_col = cell.column
+    
+    # Fallback if Total not found -> Use last column + 1
+    if not total_col:
+        total_col = sheet.max_column + 1
+
+    # Fallback if Ctn not found -> Look up in col_map
+    if not ctn_col:
+        ctn_col = col_map.get("Ctn")
+
+    if ctn_col:
+        # 2. MOVE CTN DATA TO TOTAL COLUMN
+        # Header
+        cell_total_header = sheet.cell(row=h_row, column=total_col)
+        cell_total_header.value = "Ctn" # Rename Total to Ctn
+        cell_total_header.font = bold_font
+        cell_total_header.alignment = Alignment(horizontal="center")
+
+        # Data Move Loop
+        # We move the *original* values from Ctn column to Total column
+        for row in range(h_row + 1, sheet.max_row + 1):
+            old_val = sheet.cell(row=row, column=ctn_col).value
+            sheet.cell(row=row, column=total_col).value = old_val
+            # Add basic border
+            sheet.cell(row=row, column=total_col).border = thin_border
+            sheet.cell(row=row, column=total_col).alignment = Alignment(horizontal="center")
+
+        # 3. OVERWRITE CTN COLUMN WITH PRICE
+        # Header
+        cell_price_header = sheet.cell(row=h_row, column=ctn_col)
+        cell_price_header.value = "Unit Cost (DZD)"
+        cell_price_header.font = bold_font
+        cell_price_header.fill = fill # Blue BG
+        cell_price_header.alignment = Alignment(horizontal="center")
+
+        # Fill Prices
+        for r, unit_cost in unit_costs.items():
+            cell = sheet.cell(row=r, column=ctn_col)
+            cell.value = unit_cost
+            cell.font = Font(bold=True)
+            cell.border = thin_border
+            cell.alignment = Alignment(horizontal="center")
+
+    else:
+        # Emergency Fallback if no Ctn column exists at all (Insert after name)
+        # This shouldn't happen with your file structure
+        name_col = col_map.get("ITEM", 2)
+        target_col = name_col + 1
+        sheet.insert_cols(target_col)
+        sheet.cell(row=h_row, column=target_col).value = "Unit Cost (DZD)"
+        for r, unit_cost in unit_costs.items():
+            sheet.cell(row=r, column=target_col).value = unit_cost
@@ -1,23 +1,43 @@
-import os
 import time
-import openpyxl 
-from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
+STARTED = time.perf_counter()  # cold start clock, read on the first frame
+import os
+import re
+import math
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from weakref import WeakSet
 from kivy.app import App
 from kivy.uix.boxlayout import BoxLayout
-from kivy.uix.gridlayout import GridLayout
 from kivy.uix.label import Label
 from kivy.uix.button import Button
 from kivy.uix.image import Image
 from kivy.uix.textinput import TextInput
+from kivy.uix.gridlayout import GridLayout
 from kivy.uix.scrollview import ScrollView
+from kivy.uix.spinner import Spinner
+from kivy.uix.recycleview import RecycleView
+from kivy.uix.recycleview.views import RecycleDataViewBehavior
+from kivy.uix.recyclegridlayout import RecycleGridLayout
 from kivy.uix.screenmanager import ScreenManager, Screen
-from kivy.uix.filechooser import FileChooserIconView
-from kivy.uix.popup import Popup
 from kivy.core.window import Window
 from kivy.metrics import dp
-from kivy.utils import platform
+from kivy.utils import platform, escape_markup
+from kivy.factory import Factory
 from kivy.clock import Clock
 from kivy.graphics import Color, Rectangle
+from kivy.graphics.texture import Texture
+from engine import (
+    GLOBAL_SETTINGS, SESSION_STATE, SearchIndex, TRACER, TRACE_LOG_NAME,
+    landed_unit_cost, reprice_session, parse_workbook, export_results_smart, export_report,
+    ScenarioSweep, rate_steps, export_output_path, FileIndex, FILE_INDEX_NAME, FreightAllocator, ALLOCATION_BASES,
+    normalize_search, WorkbookWatch, WATCH_INTERVAL, REIMPORT, ParseCache, PARSE_CACHE_NAME, file_stamp,
+    HistoryStore, HISTORY_NAME, ImportSnapshot, open_past_import, write_history_csv,
+)
+
+# Start-up only builds the home screen. openpyxl and PIL are imported by the code
+# that needs them, the file chooser and popups on first use, the other screens
+# when the ScreenManager first switches to them.
 
 # --- VISUAL THEME ---
 COLOR_BG = (0.1, 0.1, 0.1, 1)       
@@ -26,21 +46,6 @@ COLOR_TEXT = (1, 1, 1, 1)
 COLOR_SUBTEXT = (0.7, 0.7, 0.7, 1)  
 COLOR_CARD_BG = (0.15, 0.15, 0.15, 1)
 
-# --- CONFIGURATION ---
-GLOBAL_SETTINGS = {
-    "exchange_rate": 36.0,    
-    "shipping_rate": 50000.0, 
-    "margin_percent": 0.0     
-}
-
-SESSION_STATE = {
-    "data": [],
-    "filepath": None,
-    "header_row": 1,
-    "col_map": {},
-    "total_investment": 0
-}
-
 # --- PERMISSION LOGIC ---
 def request_android_permissions():
     """ Only runs on Android. Safe to ignore on PC. """
@@ -67,204 +72,512 @@ def request_android_permissions():
         except Exception as e:
             print(f"Permission Error: {e}")
 
-# --- LOGIC ENGINE ---
-def process_excel_preserve_images(filepath):
-    try:
-        wb = openpyxl.load_workbook(filepath, data_only=True)
-        sheet = wb.active
-        
-        # 1. EXTRACT IMAGES
-        image_map = {}
+# --- BACKGROUND IMPORT ---
+class ImportJob:
+    """ Runs parse_workbook on a worker thread and reports back through the Clock.
+    SESSION_STATE is written in one go on the UI thread, and only if the job finishes. """
+    PROGRESS_INTERVAL = 0.1  # seconds between UI updates
+
+    def __init__(self, filepath, on_progress, on_done, on_error):
+        self.filepath = filepath
+        self.on_progress = on_progress
+        self.on_done = on_done
+        self.on_error = on_error
+        self.cancel_event = threading.Event()
+        self.lock = threading.Lock()
+        self.state = ("images", 0, 0, None, 0)
+        self.last_post = 0
+
+    def start(self):
         temp_dir = os.path.abspath(App.get_running_app().user_data_dir)
-        if not os.path.exists(temp_dir):
-            os.makedirs(temp_dir)
-        
-        if hasattr(sheet, 'images'):
-            for idx, img in enumerate(sheet.images):
-                try:
-                    # Robust Anchor Logic
-                    if hasattr(img.anchor, '_from'):
-                        row = img.anchor._from.row + 1
-                    elif hasattr(img.anchor, 'row'):
-                        row = img.anchor.row + 1
-                    else:
-                        continue 
-
-                    img_name = f"img_{row}_{idx}.png"
-                    img_path = os.path.join(temp_dir, img_name)
-                    
-                    if hasattr(img, 'ref'): # Pillow
-                        img.ref.save(img_path)
-                    else:
-                        img.save(img_path)
-                        
-                    image_map[row] = img_path
-                except Exception as e:
-                    print(f"Img Error: {e}")
-
-        # 2. FIND HEADER
-        header_row_index = -1
-        col_map = {}
-        for r in range(1, 20):
-            row_values = [str(cell.value).strip() if cell.value else "" for cell in sheet[r]]
-            if "ITEM" in row_values or "Price(RMB)" in row_values:
-                header_row_index = r
-                for idx, val in enumerate(row_values):
-                    col_map[val] = idx + 1 
-                break
-        
-        if header_row_index == -1: return None, "Header not found."
+        threading.Thread(target=self.run, args=(temp_dir,), daemon=True).start()
 
-        SESSION_STATE["filepath"] = filepath
-        SESSION_STATE["header_row"] = header_row_index
-        SESSION_STATE["col_map"] = col_map
+    def cancel(self):
+        self.cancel_event.set()
 
-        results = []
-        grand_total_dzd = 0
-        
-        # 3. PROCESS ROWS
-        for r in range(header_row_index + 1, sheet.max_row + 1):
-            try:
-                def get_val(name):
-                    return sheet.cell(row=r, column=col_map[name]).value if name in col_map else 0
+    def run(self, temp_dir):
+        try:
+            results, meta = parse_workbook(self.filepath, temp_dir, self.report, self.cancel_event)
+        except Exception as e:
+            results, meta = None, str(e)
+        Clock.schedule_once(lambda dt: self.finish(results, meta))
 
-                item_name = str(sheet.cell(row=r, column=col_map.get("ITEM", 1)).value or "")
-                if item_name == "None" or item_name == "":
-                     item_name = str(sheet.cell(row=r, column=col_map.get("المنتوج", 1)).value or "Unknown")
+    def report(self, phase, rows, images, results):
+        # Worker thread: note how far the store has filled, post at most every PROGRESS_INTERVAL
+        with self.lock:
+            self.state = (phase, rows, images, results, len(results) if results is not None else 0)
+        now = time.time()
+        if now - self.last_post >= self.PROGRESS_INTERVAL:
+            self.last_post = now
+            Clock.schedule_once(self.flush)
 
-                rmb_price = float(get_val("Price(RMB)") or 0)
-                boxes_count = float(get_val("Ctn") or 0)
-                units_per_box = float(get_val("Qty") or 1) 
-                cbm_per_box = float(get_val("CBM") or 0)
+    def flush(self, dt):
+        with self.lock:
+            state = self.state
+        if not self.cancel_event.is_set():
+            self.on_progress(*state)
 
-                if boxes_count == 0: continue
+    def finish(self, results, meta):
+        if self.cancel_event.is_set(): return
+        if results is None:
+            self.on_error(meta)
+            return
+        SESSION_STATE.update(meta)
+        SESSION_STATE["data"] = results
+        SESSION_STATE["history_id"] = None
+        self.on_done()
 
-                # LOGIC: (CBM * Rate) / Qty
-                shipping_cost_box = cbm_per_box * GLOBAL_SETTINGS["shipping_rate"]
-                shipping_per_unit = shipping_cost_box / units_per_box
-                
-                product_base_dzd = rmb_price * GLOBAL_SETTINGS["exchange_rate"]
-                final_unit_cost = product_base_dzd + shipping_per_unit
-                
-                total_line_cost = final_unit_cost * (boxes_count * units_per_box)
-                grand_total_dzd += total_line_cost
-
-                img_path = image_map.get(r, None)
-
-                results.append({
-                    "row_index": r,
-                    "name": item_name,
-                    "unit_cost": round(final_unit_cost, 2),
-                    "total_line": round(total_line_cost, 2),
-                    "rmb_price": rmb_price,
-                    "qty": int(boxes_count * units_per_box),
-                    "image": img_path 
-                })
-
-            except Exception:
+class WatchJob:
+    """ Checks the imported workbook every WATCH_INTERVAL on a worker thread. Line changes
+    are handed to on_patch on the UI thread, which applies them to the loaded ResultStore;
+    an edit that needs a full import calls on_reimport once and ends the job. """
+    def __init__(self, on_patch, on_reimport):
+        self.on_patch = on_patch
+        self.on_reimport = on_reimport
+        self.stop_event = threading.Event()
+
+    def start(self):
+        temp_dir = os.path.abspath(App.get_running_app().user_data_dir)
+        watch = WorkbookWatch(SESSION_STATE["data"], SESSION_STATE["filepath"], SESSION_STATE["sheets"],
+                              SESSION_STATE["file_stamp"], temp_dir)
+        threading.Thread(target=self.run, args=(watch, temp_dir), daemon=True).start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def run(self, watch, temp_dir):
+        while not self.stop_event.wait(WATCH_INTERVAL):
+            try:
+                changes = watch.check()
+            except Exception as e:
+                print(f"Watch Error: {e}")
                 continue
-        
-        SESSION_STATE["total_investment"] = grand_total_dzd
-        return results, "Success"
+            if changes is None: continue
+            if changes is REIMPORT:
+                Clock.schedule_once(self.reimport)
+                return
+            # The store is only written on the UI thread; wait for it before the next check
+            applied = threading.Event()
+            Clock.schedule_once(lambda dt: self.patch(changes, watch.stamp, applied))
+            applied.wait()
+            if self.stop_event.is_set(): return
+            self.update_cache(watch, temp_dir)
 
-    except Exception as e:
-        return None, str(e)
+    def reimport(self, dt):
+        if not self.stop_event.is_set(): self.on_reimport()
 
-def export_results_smart():
-    data = SESSION_STATE["data"]
-    filepath = SESSION_STATE["filepath"]
-    
-    if not data or not filepath: return False, "No data"
+    def patch(self, changes, stamp, applied):
+        try:
+            if not self.stop_event.is_set():
+                SESSION_STATE["file_stamp"] = stamp
+                self.on_patch(changes)
+        finally:
+            applied.set()
 
-    try:
-        wb = openpyxl.load_workbook(filepath)
-        sheet = wb.active
-        
-        bold_font = Font(bold=True, color="FFFFFF")
-        fill = PatternFill(start_color="000080", end_color="000080", fill_type="solid")
-        thin_border = Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin'))
+    def update_cache(self, watch, temp_dir):
+        # So the next import of this file is a cache hit; skipped if it was saved again meanwhile
+        if file_stamp(watch.filepath) != watch.stamp: return
+        cache = ParseCache(os.path.join(temp_dir, PARSE_CACHE_NAME))
+        try:
+            cache.store(watch.filepath, watch.sheets, watch.results)
+        except Exception as e:
+            print(f"Watch Error: {e}")
+        finally:
+            cache.close()
 
-        h_row = SESSION_STATE["header_row"]
+# --- HISTORY ---
+class History:
+    """ The HistoryStore in user_data_dir. Imports are recorded on one worker thread,
+    in order, so saving 100k lines never holds up the UI. """
+    def __init__(self):
+        self.store = None
+        self.pool = ThreadPoolExecutor(max_workers=1)
 
-        # 1. IDENTIFY COLUMNS
-        ctn_col = None
-        total_col = None
-        
-        # Scan headers to find Ctn and Total
-        for cell in sheet[h_row]:
-            val = str(cell.value).strip().lower()
-            if val in ["ctn", "carton", "box", "boxes", "qty (ctn)"]:
-                ctn_col = cell.column
-            elif "total" in val or "amount" in val:
-                total_col = cell.column
-        
-        # Fallback if Total not found -> Use last column + 1
-        if not total_col:
-            total_col = sheet.max_column + 1
-
-        # Fallback if Ctn not found -> Look up in col_map
-        if not ctn_col:
-            ctn_col = SESSION_STATE["col_map"].get("Ctn")
-
-        if ctn_col:
-            # 2. MOVE CTN DATA TO TOTAL COLUMN
-            # Header
-            cell_total_header = sheet.cell(row=h_row, column=total_col)
-            cell_total_header.value = "Ctn" # Rename Total to Ctn
-            cell_total_header.font = bold_font
-            cell_total_header.alignment = Alignment(horizontal="center")
-
-            # Data Move Loop
-            # We move the *original* values from Ctn column to Total column
-            for row in range(h_row + 1, sheet.max_row + 1):
-                old_val = sheet.cell(row=row, column=ctn_col).value
-                sheet.cell(row=row, column=total_col).value = old_val
-                # Add basic border
-                sheet.cell(row=row, column=total_col).border = thin_border
-                sheet.cell(row=row, column=total_col).alignment = Alignment(horizontal="center")
-
-            # 3. OVERWRITE CTN COLUMN WITH PRICE
-            # Header
-            cell_price_header = sheet.cell(row=h_row, column=ctn_col)
-            cell_price_header.value = "Unit Cost (DZD)"
-            cell_price_header.font = bold_font
-            cell_price_header.fill = fill # Blue BG
-            cell_price_header.alignment = Alignment(horizontal="center")
-
-            # Fill Prices
-            for item in data:
-                r = item["row_index"]
-                cell = sheet.cell(row=r, column=ctn_col)
-                cell.value = item["unit_cost"]
-                cell.font = Font(bold=True)
-                cell.border = thin_border
-                cell.alignment = Alignment(horizontal="center")
+    def open(self, data_dir):
+        # GLOBAL_SETTINGS start from the last rates saved instead of the defaults
+        if self.store is None:
+            self.store = HistoryStore(os.path.join(data_dir, HISTORY_NAME))
+            rates = self.store.latest_rates()
+            if rates: GLOBAL_SETTINGS["exchange_rate"], GLOBAL_SETTINGS["shipping_rate"] = rates
+            else: self.record_rates()
+        return self.store
 
+    def record_rates(self):
+        if self.store: self.store.record_rates(GLOBAL_SETTINGS["exchange_rate"], GLOBAL_SETTINGS["shipping_rate"])
+
+    def record_session(self):
+        """ Saves the loaded import as it is costed now. One opened from the history is
+        left as recorded: re-costing it at today's rates is not a new shipment. """
+        data = SESSION_STATE["data"]
+        if self.store is None or not data or not SESSION_STATE["filepath"] or SESSION_STATE["history_id"] is not None: return
+        # Copied here: the UI thread goes on editing the store while the worker saves it
+        snapshot = ImportSnapshot(data, SESSION_STATE["sheets"])
+        self.pool.submit(self.run, SESSION_STATE["filepath"], snapshot, SESSION_STATE["file_stamp"])
+
+    def run(self, filepath, snapshot, stamp):
+        try:
+            self.store.record_import(filepath, snapshot, stamp)
+        except Exception as e:
+            print(f"History error: {e}")
+
+HISTORY = History()
+
+# --- FILE INDEX ---
+FILE_RESCAN_INTERVAL = 5   # seconds between incremental rescans while the picker is open
+FILE_REFRESH_INTERVAL = 1  # seconds between list refreshes while a scan is filling the index
+
+def storage_roots():
+    if platform == 'android':
+        return ['/storage/emulated/0']
+    return [os.path.expanduser("~")]
+
+class FileScanner:
+    """ Runs FileIndex.scan on a worker thread, one scan at a time. on_change is called
+    on the UI thread after a scan that re-listed any folder. """
+    def __init__(self):
+        self.index = None
+        self.on_change = None
+        self.busy = False
+        self.last_scan = 0
+        self.cancel_event = threading.Event()
+
+    def open(self, data_dir):
+        if self.index is None:
+            self.index = FileIndex(os.path.join(data_dir, FILE_INDEX_NAME), storage_roots())
+        return self.index
+
+    def scan(self, *args):
+        if self.index is None or self.busy: return
+        self.busy = True
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def run(self):
+        try:
+            listed = self.index.scan(self.cancel_event)
+        except Exception as e:
+            print(f"File index error: {e}")
+            listed = 0
+        Clock.schedule_once(lambda dt: self.done(listed))
+
+    def done(self, listed):
+        self.busy = False
+        self.last_scan = time.time()
+        if listed and self.on_change: self.on_change()
+
+FILES = FileScanner()
+
+# --- TEXTURE CACHE ---
+ATLAS_SIZE = 1024                      # px, side of one shared texture page
+TEXTURE_CELL = min(256, int(dp(128)))  # px, pictures are decoded to about their on-screen size
+TEXTURE_BUDGET = 32 * 1024 * 1024      # bytes of GPU memory for product pictures
+TEXTURE_WORKERS = 2
+
+class TextureCache:
+    """ Product pictures decoded off the main thread at display size and packed into
+    shared atlas pages, one cell per picture. Once the budget's pages are full the
+    least recently shown picture that is not on screen gives up its cell. """
+    def __init__(self):
+        self.per_row = ATLAS_SIZE // TEXTURE_CELL
+        self.max_pages = max(1, TEXTURE_BUDGET // (ATLAS_SIZE * ATLAS_SIZE * 4))
+        self.pages = []
+        self.free = []                 # (page, cell) ready for reuse
+        self.entries = OrderedDict()   # source -> (page, cell, region), least recent first
+        self.waiting = {}              # source -> callbacks of a decode in flight
+        self.slots = WeakSet()         # live ImageSlots, to know what is on screen
+        self.pool = ThreadPoolExecutor(max_workers=TEXTURE_WORKERS)
+
+    def request(self, source, callback):
+        """ callback(source, texture) right away when cached, else on a later frame.
+        texture is None when the file can't be decoded or every cell is on screen. """
+        entry = self.entries.get(source)
+        if entry is not None:
+            self.entries.move_to_end(source)
+            callback(source, entry[2])
+        elif source in self.waiting:
+            self.waiting[source].append(callback)
         else:
-            # Emergency Fallback if no Ctn column exists at all (Insert after name)
-            # This shouldn't happen with your file structure
-            name_col = SESSION_STATE["col_map"].get("ITEM", 2)
-            target_col = name_col + 1
-            sheet.insert_cols(target_col)
-            sheet.cell(row=h_row, column=target_col).value = "Unit Cost (DZD)"
-            for item in data:
-                sheet.cell(row=item["row_index"], column=target_col).value = item["unit_cost"]
-
-        timestamp = int(time.time())
-        if platform == 'android':
-            output_name = f"/storage/emulated/0/Download/CostSheet_{timestamp}.xlsx"
-        else:
-            output_name = os.path.join(os.path.expanduser("~"), "Downloads", f"CostSheet_{timestamp}.xlsx")
+            self.waiting[source] = [callback]
+            self.pool.submit(self._decode, source)
 
-        wb.save(output_name)
-        return True, output_name
+    def _decode(self, source):
+        # Worker thread: file -> RGBA bytes, bottom row first as GL expects
+        from PIL import Image as PILImage
+        try:
+            with PILImage.open(source) as img:
+                img.thumbnail((TEXTURE_CELL, TEXTURE_CELL))
+                img = img.convert("RGBA").transpose(PILImage.FLIP_TOP_BOTTOM)
+                pixels, size = img.tobytes(), img.size
+        except Exception as e:
+            print(f"Texture Error: {e}")
+            pixels, size = None, None
+        Clock.schedule_once(lambda dt: self._upload(source, pixels, size))
+
+    def _upload(self, source, pixels, size):
+        region = None
+        if pixels is not None:
+            page, cell = self._allocate()
+            if page is not None:
+                x, y = (cell % self.per_row) * TEXTURE_CELL, (cell // self.per_row) * TEXTURE_CELL
+                texture = self.pages[page]
+                texture.blit_buffer(pixels, pos=(x, y), size=size, colorfmt='rgba', bufferfmt='ubyte')
+                region = texture.get_region(x, y, *size)
+                self.entries[source] = (page, cell, region)
+        for callback in self.waiting.pop(source, []):
+            callback(source, region)
+
+    def _allocate(self):
+        if self.free:
+            return self.free.pop()
+        if len(self.pages) < self.max_pages:
+            texture = Texture.create(size=(ATLAS_SIZE, ATLAS_SIZE), colorfmt='rgba')
+            texture.add_reload_observer(self._reload)
+            self.pages.append(texture)
+            page = len(self.pages) - 1
+            self.free.extend((page, cell) for cell in range(self.per_row ** 2 - 1, 0, -1))
+            return page, 0
+        shown = {slot.source for slot in self.slots}
+        for source in self.entries:
+            if source not in shown:
+                page, cell, _ = self.entries.pop(source)
+                return page, cell
+        return None, None
 
-    except Exception as e:
-        return False, str(e)
+    def _reload(self, texture):
+        # GL context lost (Android pause/resume): the pages come back blank, decode again
+        if not self.entries: return
+        self.entries.clear()
+        self.free = [(page, cell) for page in reversed(range(len(self.pages)))
+                     for cell in range(self.per_row ** 2 - 1, -1, -1)]
+        Clock.schedule_once(lambda dt: [slot.show(slot.source) for slot in list(self.slots)])
+
+TEXTURES = TextureCache()
 
 # --- UI COMPONENTS ---
-class GalleryCard(BoxLayout):
-    def __init__(self, item, **kwargs):
+SEARCH_DEBOUNCE = 0.25  # seconds of typing silence before the list is filtered
+
+def message_popup(title, text, size_hint=(0.8,0.4)):
+    from kivy.uix.popup import Popup
+    Popup(title=title, content=Label(text=text), size_hint=size_hint).open()
+
+class LazyScreenManager(ScreenManager):
+    """ Builds a screen from `factories` the first time it is asked for by name. """
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.factories = {}
+
+    def get_screen(self, name):
+        if name in self.factories and not self.has_screen(name):
+            self.add_widget(self.factories.pop(name)(name=name))
+        return super().get_screen(name)
+
+class FileRow(RecycleDataViewBehavior, BoxLayout):
+    """ One workbook in the file picker: tap the name to import it, the side button to pin it. """
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.size_hint_y = None
+        self.height = dp(56)
+        self.spacing = 5
+        self.path = None
+        self.picker = None
+        self.btn_open = Button(markup=True, halign='left', valign='middle', padding=(dp(10), 0),
+                               background_color=COLOR_CARD_BG)
+        self.btn_open.bind(size=self.btn_open.setter('text_size'), on_press=self.open)
+        self.btn_pin = Button(size_hint_x=None, width=dp(72), font_size='13sp')
+        self.btn_pin.bind(on_press=self.toggle_pin)
+        self.add_widget(self.btn_open)
+        self.add_widget(self.btn_pin)
+
+    def refresh_view_attrs(self, rv, index, data):
+        self.path, self.picker = data['path'], rv.picker
+        self.btn_open.text = data['text']
+        self.btn_pin.text = "Unpin" if data['pinned'] else "Pin"
+        self.btn_pin.color = COLOR_ACCENT if data['pinned'] else COLOR_SUBTEXT
+
+    def open(self, instance):
+        self.picker.pick(self.path)
+
+    def toggle_pin(self, instance):
+        self.picker.toggle_pin(self.path)
+
+Factory.register('FileRow', cls=FileRow)
+
+class FilePicker:
+    """ Opens straight from the FileIndex: pinned, recent and every indexed workbook,
+    newest first, one tap to import. The index is refreshed in the background while the
+    popup is open; the folder browser is still there for files outside the index. """
+    def __init__(self, on_pick):
+        from kivy.uix.popup import Popup
+        self.on_pick = on_pick
+        self.entries = None
+
+        content = BoxLayout(orientation='vertical', spacing=5)
+        self.inp_filter = TextInput(hint_text="Filter by file name", multiline=False, size_hint_y=None, height=dp(40))
+        self.inp_filter.bind(text=lambda inst, text: self.refresh())
+        content.add_widget(self.inp_filter)
+
+        self.rv = RecycleView(key_viewclass='viewclass')
+        self.rv.picker = self
+        layout = RecycleGridLayout(cols=1, default_size=(None, dp(56)), default_size_hint=(1, None),
+                                   size_hint_y=None, spacing=2, key_viewclass='viewclass')
+        layout.bind(minimum_height=layout.setter('height'))
+        self.rv.add_widget(layout)
+        content.add_widget(self.rv)
+
+        btn_box = BoxLayout(size_hint_y=None, height=dp(48), spacing=5)
+        self.lbl_status = Label(color=COLOR_SUBTEXT, font_size='13sp')
+        btn_browse = Button(text="Browse...", size_hint_x=0.3)
+        btn_browse.bind(on_press=self.browse)
+        btn_cancel = Button(text="Cancel", size_hint_x=0.3)
+        btn_box.add_widget(self.lbl_status)
+        btn_box.add_widget(btn_browse)
+        btn_box.add_widget(btn_cancel)
+        content.add_widget(btn_box)
+
+        self.popup = Popup(title="Select File", content=content, size_hint=(0.9, 0.9))
+        btn_cancel.bind(on_press=self.popup.dismiss)
+        self.popup.bind(on_dismiss=self.closed)
+
+    def open(self):
+        self.refresh()
+        self.popup.open()
+        FILES.on_change = self.refresh
+        FILES.scan()
+        Clock.schedule_interval(self.tick, FILE_REFRESH_INTERVAL)
+
+    def closed(self, *args):
+        Clock.unschedule(self.tick)
+        FILES.on_change = None
+
+    def tick(self, dt):
+        if FILES.busy:
+            self.refresh()
+        elif time.time() - FILES.last_scan >= FILE_RESCAN_INTERVAL:
+            FILES.scan()
+
+    def refresh(self):
+        """ Rebuilds the list from the index; only touches the view if something changed. """
+        index = FILES.index
+        query = normalize_search(self.inp_filter.text.strip())
+        def matching(paths):
+            return [path for path in paths if query in normalize_search(os.path.basename(path))]
+
+        pinned = matching(index.pinned())
+        recent = [path for path in matching(index.recent()) if path not in pinned]
+        stats = {path: (size, mtime) for path, size, mtime in index.files()}
+        everything = matching(stats)
+        entries = []
+        for title, paths in (("PINNED", pinned), ("RECENT", recent), (f"ALL SPREADSHEETS ({len(everything)})", everything)):
+            if not paths: continue
+            entries.append({'viewclass': 'Label', 'text': title, 'bold': True, 'color': COLOR_ACCENT, 'height': dp(30)})
+            entries.extend({'viewclass': 'FileRow', 'path': path, 'pinned': path in pinned,
+                            'text': self.describe(path, stats.get(path))} for path in paths)
+        if entries != self.entries:
+            self.entries = entries
+            self.rv.data = entries
+        self.lbl_status.text = "Indexing..." if FILES.busy else f"{len(stats)} files indexed"
+
+    @staticmethod
+    def describe(path, stat=None):
+        if stat is None:
+            try:
+                st = os.stat(path)
+                stat = (st.st_size, st.st_mtime)
+            except OSError:
+                stat = (0, 0)
+        size, mtime = stat
+        folder = os.path.basename(os.path.dirname(path))
+        when = time.strftime("%d/%m/%Y", time.localtime(mtime))
+        return (f"[b]{escape_markup(os.path.basename(path))}[/b]\n"
+                f"[size=12sp][color=b3b3b3]{escape_markup(folder)} | {when} | {size / 1e6:.1f} MB[/color][/size]")
+
+    def pick(self, path):
+        FILES.index.touch(path)
+        self.popup.dismiss()
+        self.on_pick(path)
+
+    def toggle_pin(self, path):
+        FILES.index.pin(path, not FILES.index.is_pinned(path))
+        self.refresh()
+
+    def browse(self, instance):
+        from kivy.uix.filechooser import FileChooserIconView
+        from kivy.uix.popup import Popup
+        content = BoxLayout(orientation='vertical')
+        start_path = storage_roots()[0]
+        filechooser = FileChooserIconView(path=start_path, filters=['*.xlsx'])
+        btn_box = BoxLayout(size_hint_y=0.1)
+        btn_load = Button(text="Load")
+        btn_cancel = Button(text="Cancel")
+        content.add_widget(filechooser)
+        content.add_widget(btn_box)
+        btn_box.add_widget(btn_cancel)
+        btn_box.add_widget(btn_load)
+        popup = Popup(title="Browse Folders", content=content, size_hint=(0.9, 0.9))
+
+        def load(inst):
+            if filechooser.selection:
+                popup.dismiss()
+                self.pick(filechooser.selection[0])
+        btn_load.bind(on_press=load)
+        btn_cancel.bind(on_press=popup.dismiss)
+        popup.open()
+
+# Cards are recycled by ResultsScreen's RecycleView: children are built once,
+# refresh_view_attrs only rewrites their text for whichever item scrolls into view.
+ROW_SLOT = {}  # every rv.data entry; the row itself is read from the ResultStore
+
+class ResultsView(RecycleView):
+    """ RecycleView over a ResultStore. rv.data only holds one shared empty dict per
+    visible row (the layout needs a sequence), `rows` maps positions to store rows. """
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.store = []
+        self.rows = None  # None = every row in store order
+
+    def show(self, store, rows=None):
+        self.store, self.rows = store, rows
+        self.data = [ROW_SLOT] * (len(store) if rows is None else len(rows))
+
+    def grow(self, store, count):
+        """ Import in progress: the first `count` rows of store are ready. """
+        self.store, self.rows = store, None
+        if count > len(self.data): self.data.extend([ROW_SLOT] * (count - len(self.data)))
+
+    def item(self, index):
+        return self.store[index if self.rows is None else self.rows[index]]
+
+class ImageSlot(BoxLayout):
+    """ Holds either the product picture or a placeholder label (also shown while the
+    picture loads). Textures come from TEXTURES, never from Image.source. """
+    def __init__(self, placeholder, **kwargs):
+        super().__init__(**kwargs)
+        self.img = Image(allow_stretch=True, keep_ratio=True)
+        self.no_img = Label(text=placeholder, color=(0.5,0.5,0.5,1))
+        self.add_widget(self.no_img)
+        self.source = None
+        self.shown = None
+        TEXTURES.slots.add(self)
+
+    def show(self, source):
+        self.source = source
+        if source: TEXTURES.request(source, self.on_texture)
+        if self.shown != source or not source:
+            self.shown = None
+            self.swap(self.no_img)
+
+    def on_texture(self, source, texture):
+        if source != self.source or texture is None: return  # recycled to another row meanwhile
+        self.img.texture = texture
+        self.shown = source
+        self.swap(self.img)
+
+    def swap(self, target):
+        if target.parent is None:
+            self.clear_widgets()
+            self.add_widget(target)
+
+class GalleryCard(RecycleDataViewBehavior, BoxLayout):
+    def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self.orientation = 'vertical'
         self.size_hint_y = None
@@ -276,66 +589,104 @@ class GalleryCard(BoxLayout):
             self.rect = Rectangle(pos=self.pos, size=self.size)
         self.bind(pos=self.update_rect, size=self.update_rect)
 
-        img_source = item.get('image')
-        if img_source:
-            img = Image(source=img_source, size_hint_y=0.6, allow_stretch=True, keep_ratio=True)
-            self.add_widget(img)
-        else:
-            self.add_widget(Label(text="No Image", size_hint_y=0.6, color=(0.5,0.5,0.5,1)))
+        self.slot = ImageSlot("No Image", size_hint_y=0.6)
+        self.lbl_name = Label(size_hint_y=0.2, color=COLOR_TEXT, bold=True)
+        self.lbl_cost = Label(size_hint_y=0.2, color=COLOR_ACCENT, bold=True, font_size='18sp')
+        self.add_widget(self.slot)
+        self.add_widget(self.lbl_name)
+        self.add_widget(self.lbl_cost)
 
-        self.add_widget(Label(text=item['name'][:15] + "...", size_hint_y=0.2, color=COLOR_TEXT, bold=True))
-        self.add_widget(Label(text=f"{item['unit_cost']} DA", size_hint_y=0.2, color=COLOR_ACCENT, bold=True, font_size='18sp'))
+    def refresh_view_attrs(self, rv, index, data):
+        item = rv.item(index)
+        self.slot.show(item.get('image'))
+        self.lbl_name.text = item['name'][:15] + "..."
+        self.lbl_cost.text = f"{item['unit_cost']} DA"
 
     def update_rect(self, *args):
         self.rect.pos = self.pos
         self.rect.size = self.size
 
-class InfoCard(BoxLayout):
-    def __init__(self, item, **kwargs):
+class InfoCard(RecycleDataViewBehavior, BoxLayout):
+    def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self.orientation = 'horizontal' 
         self.size_hint_y = None
         self.height = dp(120)
         self.padding = 10
         self.spacing = 10
+
+        # Separator line (replaces the 1px Button that used to follow each card)
+        with self.canvas.after:
+            Color(0.3,0.3,0.3,1)
+            self.sep = Rectangle(pos=self.pos, size=(self.width, 1))
+        self.bind(pos=self.update_sep, size=self.update_sep)
         
-        img_source = item.get('image')
-        if img_source:
-            img = Image(source=img_source, size_hint_x=0.3, allow_stretch=True, keep_ratio=True)
-            self.add_widget(img)
-        else:
-            lbl = Label(text="No IMG", size_hint_x=0.3, color=(0.5,0.5,0.5,1))
-            self.add_widget(lbl)
+        self.slot = ImageSlot("No IMG", size_hint_x=0.3)
+        self.add_widget(self.slot)
 
         text_box = BoxLayout(orientation='vertical')
         top = BoxLayout()
-        lbl_name = Label(text=f"[b]{item['name']}[/b]", markup=True, halign="left", valign="middle", color=COLOR_TEXT, font_size='16sp')
-        lbl_name.bind(size=lbl_name.setter('text_size'))
-        lbl_cost = Label(text=f"{item['unit_cost']} DA", color=COLOR_ACCENT, font_size='20sp', bold=True, size_hint_x=0.4, halign='right')
-        top.add_widget(lbl_name)
-        top.add_widget(lbl_cost)
+        self.lbl_name = Label(markup=True, halign="left", valign="middle", color=COLOR_TEXT, font_size='16sp')
+        self.lbl_name.bind(size=self.lbl_name.setter('text_size'))
+        self.lbl_cost = Label(color=COLOR_ACCENT, font_size='20sp', bold=True, size_hint_x=0.4, halign='right')
+        top.add_widget(self.lbl_name)
+        top.add_widget(self.lbl_cost)
         
         bot = BoxLayout()
-        lbl_detail = Label(text=f"Qty: {item['qty']} | RMB: {item['rmb_price']}", color=COLOR_SUBTEXT, font_size='13sp')
-        lbl_total = Label(text=f"Total: {int(item['total_line']):,} DA", color=COLOR_SUBTEXT, font_size='13sp', halign='right')
-        bot.add_widget(lbl_detail)
-        bot.add_widget(lbl_total)
+        self.lbl_detail = Label(color=COLOR_SUBTEXT, font_size='13sp')
+        self.lbl_total = Label(color=COLOR_SUBTEXT, font_size='13sp', halign='right')
+        bot.add_widget(self.lbl_detail)
+        bot.add_widget(self.lbl_total)
         
         text_box.add_widget(top)
         text_box.add_widget(bot)
         self.add_widget(text_box)
 
-class TableRow(BoxLayout):
-    def __init__(self, item, **kwargs):
+    def refresh_view_attrs(self, rv, index, data):
+        item = rv.item(index)
+        self.slot.show(item.get('image'))
+        self.lbl_name.text = f"[b]{item['name']}[/b]"
+        self.lbl_cost.text = f"{item['unit_cost']} DA"
+        self.lbl_detail.text = f"Qty: {item['qty']} | RMB: {item['rmb_price']}"
+        if item['sheet'] and len(rv.store.sheets) > 1: self.lbl_detail.text = f"{item['sheet']} | " + self.lbl_detail.text
+        if item.get('lines', 1) > 1: self.lbl_detail.text = f"{item['lines']} lines | " + self.lbl_detail.text
+        self.lbl_total.text = f"Total: {int(item['total_line']):,} DA"
+
+    def update_sep(self, *args):
+        self.sep.pos = self.pos
+        self.sep.size = (self.width, 1)
+
+class TableRow(RecycleDataViewBehavior, BoxLayout):
+    def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self.orientation = 'horizontal'
         self.size_hint_y = None
         self.height = dp(40)
         self.spacing = 10
-        self.add_widget(Label(text=item['name'][:20], size_hint_x=0.5, halign='left', color=COLOR_TEXT))
-        self.add_widget(Label(text=str(item['unit_cost']), size_hint_x=0.2, color=COLOR_ACCENT, bold=True))
-        self.add_widget(Label(text=str(item['qty']), size_hint_x=0.15, color=COLOR_SUBTEXT))
-        self.add_widget(Label(text=f"{int(item['total_line']):,}", size_hint_x=0.25, color=COLOR_SUBTEXT))
+        self.lbl_name = Label(size_hint_x=0.5, halign='left', color=COLOR_TEXT)
+        self.lbl_cost = Label(size_hint_x=0.2, color=COLOR_ACCENT, bold=True)
+        self.lbl_qty = Label(size_hint_x=0.15, color=COLOR_SUBTEXT)
+        self.lbl_total = Label(size_hint_x=0.25, color=COLOR_SUBTEXT)
+        for lbl in (self.lbl_name, self.lbl_cost, self.lbl_qty, self.lbl_total):
+            self.add_widget(lbl)
+
+    def refresh_view_attrs(self, rv, index, data):
+        item = rv.item(index)
+        self.lbl_name.text = item['name'][:20]
+        self.lbl_cost.text = str(item['unit_cost'])
+        self.lbl_qty.text = str(item['qty'])
+        self.lbl_total.text = f"{int(item['total_line']):,}"
+
+SORT_LABELS = {None: "Sheet order", "unit_cost": "Unit cost", "total_line": "Line total",
+               "qty": "Quantity", "rmb_price": "RMB price", "name": "Name"}
+SORT_BY_LABEL = {label: key for key, label in SORT_LABELS.items()}
+
+# view mode -> (card class, columns, row height)
+VIEW_MODES = {
+    "list": (InfoCard, 1, dp(120)),
+    "table": (TableRow, 1, dp(40)),
+    "gallery": (GalleryCard, 2, dp(220)),
+}
 
 # --- SCREENS ---
 
@@ -355,6 +706,10 @@ class HomeScreen(Screen):
         btn_import.bind(on_press=self.show_file_chooser)
         layout.add_widget(btn_import)
 
+        btn_history = Button(text="🕘 PAST IMPORTS", size_hint=(1, 0.15), background_color=(0.1, 0.1, 0.1, 1), color=COLOR_SUBTEXT)
+        btn_history.bind(on_press=lambda i: setattr(self.manager, 'current', 'history'))
+        layout.add_widget(btn_history)
+
         btn_settings = Button(text="⚙️ SETTINGS", size_hint=(1, 0.15), background_color=(0.1, 0.1, 0.1, 1), color=COLOR_SUBTEXT)
         btn_settings.bind(on_press=self.go_settings)
         layout.add_widget(btn_settings)
@@ -393,12 +748,7 @@ class HomeScreen(Screen):
                 qty = float(inp_qty.text) if inp_qty.text else 1
                 if qty == 0: qty = 1
                 
-                # Formula: (CBM * 50000 / Qty) + (RMB * 36)
-                shipping_box = cbm * GLOBAL_SETTINGS["shipping_rate"]
-                shipping_unit = shipping_box / qty
-                base_cost = rmb * GLOBAL_SETTINGS["exchange_rate"]
-                
-                total = base_cost + shipping_unit
+                total = landed_unit_cost(rmb, cbm, qty, GLOBAL_SETTINGS["exchange_rate"], GLOBAL_SETTINGS["shipping_rate"])
                 lbl_result.text = f"{total:,.2f} DA"
             except:
                 lbl_result.text = "Error"
@@ -412,40 +762,17 @@ class HomeScreen(Screen):
         content.add_widget(btn_calc)
         content.add_widget(lbl_result)
         
+        from kivy.uix.popup import Popup
         popup = Popup(title="Landing Cost Calculator", content=content, size_hint=(0.9, 0.6))
         popup.open()
     
     def show_file_chooser(self, instance):
         request_android_permissions()
-        content = BoxLayout(orientation='vertical')
-        
-        if platform == 'android':
-            start_path = '/storage/emulated/0'
-        else:
-            start_path = os.path.expanduser("~")
-            
-        filechooser = FileChooserIconView(path=start_path, filters=['*.xlsx'])
-        btn_box = BoxLayout(size_hint_y=0.1)
-        btn_load = Button(text="Load")
-        btn_cancel = Button(text="Cancel")
-        content.add_widget(filechooser)
-        content.add_widget(btn_box)
-        btn_box.add_widget(btn_cancel)
-        btn_box.add_widget(btn_load)
-        popup = Popup(title="Select File", content=content, size_hint=(0.9, 0.9))
-        
-        def load(inst):
-            if filechooser.selection:
-                data, status = process_excel_preserve_images(filechooser.selection[0])
-                if data:
-                    SESSION_STATE["data"] = data
-                    self.manager.get_screen('results').load_data()
-                    self.manager.current = 'results'
-                    popup.dismiss()
-                else: print(status)
-        btn_load.bind(on_press=load)
-        btn_cancel.bind(on_press=popup.dismiss)
-        popup.open()
+        FilePicker(self.import_file).open()
+
+    def import_file(self, filepath):
+        self.manager.get_screen('results').start_import(filepath)
+        self.manager.current = 'results'
 
 class ResultsScreen(Screen):
     def __init__(self, **kwargs):
@@ -457,83 +784,575 @@ class ResultsScreen(Screen):
         btn_back = Button(text="<", size_hint_x=None, width=dp(50), background_color=(0.3,0.3,0.3,1))
         btn_back.bind(on_press=self.back)
         self.lbl_summary = Label(text="Loading...", markup=True, halign='center')
-        btn_exp = Button(text="SAVE\nEXCEL", size_hint_x=None, width=dp(80), background_color=COLOR_ACCENT, bold=True)
-        btn_exp.bind(on_press=self.export)
+        self.lbl_summary.bind(on_touch_down=self.summary_touch)
+        self.btn_exp = Button(text="SAVE\nEXCEL", size_hint_x=None, width=dp(80), background_color=COLOR_ACCENT, bold=True)
+        self.btn_exp.bind(on_press=self.export)
+        self.btn_cancel = Button(text="CANCEL", size_hint_x=None, width=dp(80), background_color=(0.7,0.2,0.2,1), bold=True)
+        self.btn_cancel.bind(on_press=self.cancel_import)
         dash.add_widget(btn_back)
         dash.add_widget(self.lbl_summary)
-        dash.add_widget(btn_exp)
+        dash.add_widget(self.btn_exp)
+        self.dash = dash
         self.layout.add_widget(dash)
+        self.job = None
         
         controls = BoxLayout(size_hint_y=None, height=dp(50), spacing=10)
-        self.search_input = TextInput(hint_text="Search product...", size_hint_x=0.7, multiline=False)
+        self.search_input = TextInput(hint_text="Search product...", size_hint_x=0.4, multiline=False)
         self.search_input.bind(text=self.filter_list)
+        self.search_trigger = Clock.create_trigger(self.run_filter, SEARCH_DEBOUNCE)
+        self.pending_filter = ""
+        self.search_index = None
+        self.search_index_data = None
         
-        self.btn_view = Button(text="View: List", size_hint_x=0.3, background_color=(0.2,0.2,0.2,1))
+        self.btn_view = Button(text="View: List", size_hint_x=0.2, background_color=(0.2,0.2,0.2,1))
         self.btn_view.bind(on_press=self.toggle_view)
+        btn_whatif = Button(text="What-if", size_hint_x=0.2, background_color=(0.1,0.3,0.5,1))
+        btn_whatif.bind(on_press=lambda i: setattr(self.manager, 'current', 'scenarios'))
+        # Watch mode: edits saved to the imported file are patched into the list
+        self.btn_watch = Button(text="Watch: Off", size_hint_x=0.2, background_color=(0.2,0.2,0.2,1))
+        self.btn_watch.bind(on_press=self.toggle_watch)
+        self.watching = False
+        self.watch = None
 
         controls.add_widget(self.search_input)
         controls.add_widget(self.btn_view)
+        controls.add_widget(btn_whatif)
+        controls.add_widget(self.btn_watch)
         self.layout.add_widget(controls)
 
+        # Sorting and grouping reuse orders the store keeps per column
+        self.sort_key = None  # None = sheet order
+        self.descending = True
+        self.grouped = False
+        sorting = BoxLayout(size_hint_y=None, height=dp(40), spacing=10)
+        self.sort_spinner = Spinner(text=SORT_LABELS[None], values=list(SORT_LABELS.values()), size_hint_x=0.4,
+                                    background_color=(0.2,0.2,0.2,1))
+        self.sort_spinner.bind(text=self.pick_sort)
+        self.btn_dir = Button(text="High first", size_hint_x=0.2, background_color=(0.2,0.2,0.2,1))
+        self.btn_dir.bind(on_press=lambda i: self.sort_by(self.sort_key, not self.descending))
+        self.btn_group = Button(text="Group: Off", size_hint_x=0.2, background_color=(0.2,0.2,0.2,1))
+        self.btn_group.bind(on_press=self.toggle_group)
+        btn_freight = Button(text="Freight", size_hint_x=0.2, background_color=(0.1,0.3,0.5,1))
+        btn_freight.bind(on_press=lambda i: setattr(self.manager, 'current', 'freight'))
+        for widget in (self.sort_spinner, self.btn_dir, self.btn_group, btn_freight):
+            sorting.add_widget(widget)
+        self.layout.add_widget(sorting)
+
+        # Table headers sort by their column; tapping the active one flips the direction
         self.table_header = BoxLayout(size_hint_y=None, height=dp(30), spacing=10)
-        self.table_header.add_widget(Label(text="Product", size_hint_x=0.5, color=COLOR_ACCENT))
-        self.table_header.add_widget(Label(text="Cost", size_hint_x=0.2, color=COLOR_ACCENT))
-        self.table_header.add_widget(Label(text="Qty", size_hint_x=0.15, color=COLOR_ACCENT))
-        self.table_header.add_widget(Label(text="Total", size_hint_x=0.25, color=COLOR_ACCENT))
+        for text, key, width in (("Product", "name", 0.5), ("Cost", "unit_cost", 0.2), ("Qty", "qty", 0.15), ("Total", "total_line", 0.25)):
+            btn = Button(text=text, size_hint_x=width, color=COLOR_ACCENT, background_color=(0,0,0,0))
+            btn.bind(on_press=lambda i, key=key: self.sort_by(key, not self.descending if key == self.sort_key else True))
+            self.table_header.add_widget(btn)
         self.table_header.opacity = 0 
         self.layout.add_widget(self.table_header)
 
-        self.scroll = ScrollView()
-        self.grid = GridLayout(cols=1, spacing=5, size_hint_y=None)
+        # Only the visible cards exist; they are reused while scrolling
+        self.rv = ResultsView()
+        self.grid = RecycleGridLayout(cols=1, spacing=5, size_hint_y=None, default_size_hint=(1, None))
         self.grid.bind(minimum_height=self.grid.setter('height'))
-        self.scroll.add_widget(self.grid)
-        self.layout.add_widget(self.scroll)
+        self.rv.add_widget(self.grid)
+        self.apply_view_mode()
+        self.layout.add_widget(self.rv)
         self.add_widget(self.layout)
 
-    def back(self, i): self.manager.current = 'home'
+        # Hidden debug overlay: double-tap the summary to see the last import/export/render breakdown
+        self.overlay = Label(size_hint_y=None, height=dp(200), font_name='RobotoMono-Regular', font_size='11sp',
+                             halign='left', valign='top', color=COLOR_SUBTEXT)
+        self.overlay.bind(size=self.overlay.setter('text_size'))
+
+    def back(self, i):
+        if self.job: self.cancel_import(i)
+        self.manager.current = 'home'
+
+    # --- background import ---
+    def start_import(self, filepath):
+        if self.job: self.job.cancel()
+        self.stop_watch()
+        self.job = ImportJob(filepath, self.import_progress, self.import_done, self.import_error)
+        self.dash.remove_widget(self.btn_exp)
+        if self.btn_cancel.parent is None: self.dash.add_widget(self.btn_cancel)
+        self.lbl_summary.text = "[b]Importing...[/b]"
+        self.rv.show([])
+        self.job.start()
+
+    def import_progress(self, phase, rows, images, results, count):
+        if results is not None: self.rv.grow(results, count)
+        self.lbl_summary.text = f"[b]Importing {phase}...[/b]\n{rows:,} rows | {images} images | {len(self.rv.data):,} items"
+
+    def end_import(self):
+        self.job = None
+        self.dash.remove_widget(self.btn_cancel)
+        if self.btn_exp.parent is None: self.dash.add_widget(self.btn_exp)
+
+    def import_done(self):
+        self.end_import()
+        self.load_data()
+        self.refresh_overlay()
+        HISTORY.record_session()
+        if self.watching: self.start_watch()
+
+    def import_error(self, status):
+        self.end_import()
+        self.load_data()
+        self.manager.current = 'home'
+        message_popup("Error", str(status))
+
+    def cancel_import(self, instance):
+        # The job's results are dropped, SESSION_STATE still holds the previous import
+        if self.job: self.job.cancel()
+        self.end_import()
+        self.load_data()
+        self.manager.current = 'home'
+
+    # --- watch mode ---
+    def toggle_watch(self, instance):
+        self.watching = not self.watching
+        self.btn_watch.text = "Watch: On" if self.watching else "Watch: Off"
+        if self.watching and not self.job: self.start_watch()
+        if not self.watching: self.stop_watch()
+
+    def start_watch(self):
+        self.stop_watch()
+        if not SESSION_STATE["data"] or not SESSION_STATE["filepath"]: return
+        self.watch = WatchJob(self.watch_patch, self.watch_reimport)
+        self.watch.start()
+
+    def stop_watch(self):
+        if self.watch: self.watch.stop()
+        self.watch = None
+
+    def watch_patch(self, changes):
+        data = SESSION_STATE["data"]
+        with TRACER.span("render", "watch_patch", changes=len(changes)):
+            added, changed, removed = data.apply(changes)
+        SESSION_STATE["total_investment"] = data.engine.total_investment
+        self.search_index = None  # names may have changed under the same store
+        self.load_data(filter_text=self.search_input.text, keep_scroll=True)
+        self.lbl_summary.text += f"\n[color=b3b3b3]File updated: +{added} ~{changed} -{removed}[/color]"
+        HISTORY.record_session()
+
+    def watch_reimport(self):
+        self.watch = None
+        self.start_import(SESSION_STATE["filepath"])
+
     def export(self, i):
-        success, name = export_results_smart()
-        if success: Popup(title="Success", content=Label(text=f"Saved:\n{name}"), size_hint=(0.7,0.4)).open()
-        else: Popup(title="Error", content=Label(text=str(name)), size_hint=(0.8,0.4)).open()
+        from kivy.uix.popup import Popup
+        content = BoxLayout(orientation='vertical', padding=10, spacing=10)
+        popup = Popup(title="Save", content=content, size_hint=(0.8, 0.5))
+        for text, run in (("Costed workbook (.xlsx)", export_results_smart),
+                          ("Cost report (.xlsx)", lambda: export_report("xlsx")),
+                          ("Cost report (.csv)", lambda: export_report("csv"))):
+            btn = Button(text=text, background_color=(0.2,0.2,0.2,1))
+            btn.bind(on_press=lambda inst, run=run: self.run_export(popup, run))
+            content.add_widget(btn)
+        popup.open()
+
+    def run_export(self, popup, run):
+        popup.dismiss()
+        success, name = run()
+        self.refresh_overlay()
+        if success: message_popup("Success", f"Saved:\n{name}", (0.7,0.4))
+        else: message_popup("Error", str(name))
     
+    # --- debug overlay ---
+    def summary_touch(self, widget, touch):
+        if widget.collide_point(*touch.pos) and touch.is_double_tap:
+            self.toggle_overlay()
+            return True
+
+    def toggle_overlay(self):
+        if self.overlay.parent:
+            self.layout.remove_widget(self.overlay)
+            TRACER.enabled = False
+        else:
+            TRACER.enabled = True
+            self.layout.add_widget(self.overlay)
+            self.refresh_overlay()
+
+    def refresh_overlay(self):
+        if self.overlay.parent: self.overlay.text = TRACER.summary()
+
+    def trace_frame(self, started, phase):
+        # Runs on the next Clock tick, so it includes the RecycleView layout pass
+        def done(dt):
+            TRACER.record("render", phase, time.perf_counter() - started, view=self.view_mode, items=len(self.rv.data))
+            self.refresh_overlay()
+        Clock.schedule_once(done)
+
     def toggle_view(self, instance):
+        started = time.perf_counter()
         if self.view_mode == "list":
             self.view_mode = "table"
             self.btn_view.text = "View: Table"
             self.table_header.opacity = 1
-            self.grid.cols = 1
         elif self.view_mode == "table":
             self.view_mode = "gallery"
             self.btn_view.text = "View: Gallery"
             self.table_header.opacity = 0
-            self.grid.cols = 2
         else:
             self.view_mode = "list"
             self.btn_view.text = "View: List"
             self.table_header.opacity = 0
-            self.grid.cols = 1
-        self.load_data() 
+        self.apply_view_mode()
+        if TRACER.enabled: self.trace_frame(started, "toggle_view")
+
+    def apply_view_mode(self):
+        view_cls, cols, row_height = VIEW_MODES[self.view_mode]
+        self.grid.cols = cols
+        self.grid.default_size = (None, row_height)
+        self.rv.viewclass = view_cls
+        self.rv.refresh_from_data()
         
     def filter_list(self, instance, value):
-        self.load_data(filter_text=value)
+        # Debounced: only the last keystroke within SEARCH_DEBOUNCE renders
+        self.pending_filter = value
+        self.search_trigger.cancel()
+        self.search_trigger()
+
+    def run_filter(self, dt):
+        self.load_data(filter_text=self.pending_filter)
+
+    def pick_sort(self, spinner, label):
+        if SORT_BY_LABEL[label] != self.sort_key: self.sort_by(SORT_BY_LABEL[label], self.descending)
+
+    def sort_by(self, key, descending):
+        self.sort_key, self.descending = key, descending
+        self.btn_dir.text = "High first" if descending else "Low first"
+        if self.sort_spinner.text != SORT_LABELS[key]: self.sort_spinner.text = SORT_LABELS[key]
+        self.load_data(filter_text=self.search_input.text)
+
+    def toggle_group(self, instance):
+        self.grouped = not self.grouped
+        self.btn_group.text = "Group: On" if self.grouped else "Group: Off"
+        self.load_data(filter_text=self.search_input.text)
         
-    def load_data(self, filter_text=""):
-        self.grid.clear_widgets()
+    def load_data(self, filter_text="", keep_scroll=False):
+        started = time.perf_counter()
+        TRACER.begin("render")
+        data = SESSION_STATE["data"]
         total_d = SESSION_STATE.get("total_investment", 0)
-        count = len(SESSION_STATE["data"])
+        count = len(data)
         self.lbl_summary.text = f"[b]{count} Items[/b]\nTotal: [color=00cc66]{int(total_d):,} DA[/color]"
-        filter_text = filter_text.lower()
-        
-        for item in SESSION_STATE["data"]:
-            if filter_text and filter_text not in item['name'].lower(): continue
-            
-            if self.view_mode == "list":
-                self.grid.add_widget(InfoCard(item))
-                self.grid.add_widget(Button(size_hint_y=None, height=1, background_color=(0.3,0.3,0.3,1)))
-            elif self.view_mode == "table":
-                self.grid.add_widget(TableRow(item))
-            elif self.view_mode == "gallery":
-                self.grid.add_widget(GalleryCard(item))
+        if data and data.engine.allocation:
+            self.lbl_summary.text += f" [color=b3b3b3](freight by {data.engine.allocation[1]})[/color]"
+        if data and len(data.sheets) > 1:
+            self.lbl_summary.text += "\n" + "  |  ".join(
+                f"{name}: {int(total):,}" for name, total in zip(data.sheets, data.sheet_totals()))
+
+        # Grouped view: same search/sort/render path, over one entry per product
+        source = data
+        if self.grouped and data:
+            with TRACER.span("render", "group", items=count):
+                source = data.groups()
+            self.lbl_summary.text = self.lbl_summary.text.replace(f"{count} Items", f"{len(source)} Products", 1)
+
+        if self.search_index is None or self.search_index_data is not source:
+            self.search_index = None
+            self.search_index_data = source
+        if filter_text and self.search_index is None:
+            with TRACER.span("render", "search_index", items=len(source)):
+                self.search_index = SearchIndex(source.name_column() if source else [])
+
+        rows = self.search_index.search(filter_text) if self.search_index else None
+        if self.sort_key and source:
+            with TRACER.span("render", "sort", key=self.sort_key, items=len(source)):
+                rows = source.sort.arrange(self.sort_key, rows, self.descending)
+        self.rv.show(source, rows)
+        if not keep_scroll: self.rv.scroll_y = 1
+        if TRACER.enabled: self.trace_frame(started, "load_data")
+
+SCENARIO_MAX_STEPS = 25  # per rate; the table has one Label per scenario
+
+class ScenarioScreen(Screen):
+    """ What-if table: total investment of the loaded import over a range of each rate. """
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        layout = BoxLayout(orientation='vertical', padding=10, spacing=10)
+        layout.add_widget(Label(text="WHAT-IF RATES", font_size='22sp', color=COLOR_ACCENT, size_hint_y=None, height=dp(40)))
+
+        self.inputs = {}
+        for lbl, key in (("Exchange", "exchange_rate"), ("Shipping", "shipping_rate")):
+            row = BoxLayout(size_hint_y=None, height=dp(40), spacing=5)
+            row.add_widget(Label(text=lbl, size_hint_x=0.25, color=COLOR_TEXT))
+            for part, hint in (("from", "From"), ("to", "To"), ("steps", "Steps")):
+                inp = TextInput(hint_text=hint, multiline=False, write_tab=False, input_filter='int' if part == "steps" else 'float',
+                                background_color=(0.2,0.2,0.2,1), foreground_color=(1,1,1,1))
+                self.inputs[key, part] = inp
+                row.add_widget(inp)
+            layout.add_widget(row)
+
+        buttons = BoxLayout(size_hint_y=None, height=dp(50), spacing=10)
+        for text, handler, color in (("<", self.back, (0.3,0.3,0.3,1)), ("RUN", self.run, COLOR_ACCENT),
+                                     ("EXPORT CSV", self.export, (0.1,0.3,0.5,1))):
+            btn = Button(text=text, background_color=color, bold=True)
+            btn.bind(on_press=handler)
+            buttons.add_widget(btn)
+        layout.add_widget(buttons)
+
+        self.lbl_status = Label(size_hint_y=None, height=dp(40), color=COLOR_SUBTEXT)
+        layout.add_widget(self.lbl_status)
+        self.table = GridLayout(size_hint=(None, None), spacing=1)
+        self.table.bind(minimum_height=self.table.setter('height'), minimum_width=self.table.setter('width'))
+        scroll = ScrollView(do_scroll_x=True)
+        scroll.add_widget(self.table)
+        layout.add_widget(scroll)
+        self.add_widget(layout)
+        self.sweep = None
+
+    def back(self, i): self.manager.current = 'results'
+
+    def on_pre_enter(self, *args):
+        # Start from +-10% around the current settings
+        for key in ("exchange_rate", "shipping_rate"):
+            if not self.inputs[key, "from"].text:
+                rate = GLOBAL_SETTINGS[key]
+                self.inputs[key, "from"].text = f"{rate * 0.9:g}"
+                self.inputs[key, "to"].text = f"{rate * 1.1:g}"
+                self.inputs[key, "steps"].text = "5"
+        self.run(None)
+
+    def run(self, instance):
+        engine = SESSION_STATE.get("engine")
+        if engine is None or not len(engine):
+            self.lbl_status.text = "Import a file first"
+            return
+        try:
+            axes = {}
+            for key in ("exchange_rate", "shipping_rate"):
+                steps = min(max(int(self.inputs[key, "steps"].text or 1), 1), SCENARIO_MAX_STEPS)
+                axes[key] = rate_steps(float(self.inputs[key, "from"].text), float(self.inputs[key, "to"].text), steps)
+        except ValueError:
+            self.lbl_status.text = "Check the rate ranges"
+            return
+
+        started = time.perf_counter()
+        self.sweep = ScenarioSweep(engine, axes["exchange_rate"], axes["shipping_rate"])
+        elapsed = (time.perf_counter() - started) * 1000
+        current = SESSION_STATE.get("total_investment", 0)
+        self.lbl_status.text = (f"{len(self.sweep)} scenarios x {len(engine):,} lines in {elapsed:.1f} ms\n"
+                                f"Current rates: {int(current):,} DA")
+        if engine.allocation:
+            self.lbl_status.text += f" | freight split by {engine.allocation[1]}: shipping rate not used"
+        self.fill_table(current)
+
+    def fill_table(self, current):
+        sweep = self.sweep
+        self.table.clear_widgets()
+        self.table.cols = len(sweep.shipping_rates) + 1
+
+        def cell(text, color):
+            return Label(text=text, color=color, size_hint=(None, None), size=(dp(110), dp(30)), font_size='12sp')
+        self.table.add_widget(cell("Ex \\ DA/CBM", COLOR_ACCENT))
+        for sh in sweep.shipping_rates:
+            self.table.add_widget(cell(f"{sh:,.0f}", COLOR_ACCENT))
+        for ex, row in zip(sweep.exchange_rates, sweep.totals):
+            self.table.add_widget(cell(f"{ex:g}", COLOR_ACCENT))
+            for total in row:
+                self.table.add_widget(cell(f"{int(total):,}", COLOR_TEXT if total <= current else (1, 0.5, 0.4, 1)))
+
+    def export(self, instance):
+        if self.sweep is None: return
+        try:
+            path = export_output_path("CostScenarios", "csv")
+            self.sweep.write_csv(path)
+            message_popup("Success", f"Saved:\n{path}", (0.7,0.4))
+        except Exception as e:
+            message_popup("Error", str(e))
+
+def amount_text(amount):
+    """ DA amount as typed: no exponent, no trailing zero centimes. """
+    return f"{amount:.2f}".rstrip("0").rstrip(".")
+
+class FreightScreen(Screen):
+    """ Container freight: splits a groupage invoice (container total plus fees) over the
+    loaded lines by volume, weight or value instead of the per-CBM shipping rate.
+    Each basis button re-prices the list straight away, so methods can be compared. """
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        layout = BoxLayout(orientation='vertical', padding=10, spacing=10)
+        layout.add_widget(Label(text="CONTAINER FREIGHT", font_size='22sp', color=COLOR_ACCENT, size_hint_y=None, height=dp(40)))
+
+        self.inputs = {}
+        for lbl, key, hint in (("Container (DA)", "container", "Invoice total"), ("Fees (DA)", "fees", "e.g. 45000 + 12500")):
+            row = BoxLayout(size_hint_y=None, height=dp(40), spacing=5)
+            row.add_widget(Label(text=lbl, size_hint_x=0.35, color=COLOR_TEXT))
+            inp = TextInput(hint_text=hint, multiline=False, write_tab=False,
+                            background_color=(0.2,0.2,0.2,1), foreground_color=(1,1,1,1))
+            self.inputs[key] = inp
+            row.add_widget(inp)
+            layout.add_widget(row)
+
+        self.basis_buttons = {}
+        bases = BoxLayout(size_hint_y=None, height=dp(50), spacing=10)
+        for basis in ALLOCATION_BASES + (None,):
+            btn = Button(text=basis.title() if basis else "Per CBM", background_color=(0.2,0.2,0.2,1))
+            btn.bind(on_press=lambda i, basis=basis: self.allocate(basis))
+            self.basis_buttons[basis] = btn
+            bases.add_widget(btn)
+        layout.add_widget(bases)
+
+        btn_back = Button(text="<", size_hint_y=None, height=dp(50), background_color=(0.3,0.3,0.3,1), bold=True)
+        btn_back.bind(on_press=self.back)
+        layout.add_widget(btn_back)
+        self.lbl_status = Label(color=COLOR_SUBTEXT, halign='center', valign='top')
+        self.lbl_status.bind(size=self.lbl_status.setter('text_size'))
+        layout.add_widget(self.lbl_status)
+        self.add_widget(layout)
+        self.allocator = None
+        self.allocator_stamp = None
+
+    def back(self, i): self.manager.current = 'results'
+
+    def current_allocator(self):
+        """ The bases are rebuilt only when another import is loaded or the watch edited it. """
+        data = SESSION_STATE["data"]
+        stamp = (id(data.engine), data.revision, len(data))
+        if stamp != self.allocator_stamp:
+            self.allocator, self.allocator_stamp = FreightAllocator(data.engine), stamp
+        return self.allocator
+
+    def on_pre_enter(self, *args):
+        data = SESSION_STATE["data"]
+        if not data:
+            self.lbl_status.text = "Import a file first"
+            return
+        allocator = self.current_allocator()
+        for basis in ALLOCATION_BASES:
+            self.basis_buttons[basis].disabled = basis not in allocator.available()
+        if data.engine.allocation:
+            charges, basis = data.engine.allocation
+            self.inputs["container"].text = amount_text(charges[0])
+            self.inputs["fees"].text = " + ".join(amount_text(fee) for fee in charges[1:])
+        self.show(data.engine.allocation[1] if data.engine.allocation else None)
+
+    def charges(self):
+        """ Container total followed by each fee; raises ValueError on anything else. """
+        fees = [part for part in re.split(r"[+\s]+", self.inputs["fees"].text.strip()) if part]
+        return [float(self.inputs["container"].text or 0)] + [float(fee) for fee in fees]
+
+    def allocate(self, basis):
+        data = SESSION_STATE["data"]
+        if not data: return
+        allocator = self.current_allocator()
+        try:
+            charges = self.charges() if basis else None
+        except ValueError:
+            self.lbl_status.text = "Check the amounts"
+            return
+        started = time.perf_counter()
+        try:
+            if basis is None:
+                allocator.clear()
+            else:
+                allocator.apply(charges, basis)
+        except ValueError as e:
+            self.lbl_status.text = str(e)
+            return
+        elapsed = (time.perf_counter() - started) * 1000
+        SESSION_STATE["total_investment"] = data.engine.total_investment
+        results = self.manager.get_screen('results')
+        results.load_data(filter_text=results.search_input.text, keep_scroll=True)
+        self.show(basis, elapsed)
+        HISTORY.record_session()
+
+    def show(self, basis, elapsed=None):
+        engine = SESSION_STATE["data"].engine
+        for key, btn in self.basis_buttons.items():
+            btn.background_color = COLOR_ACCENT if key == basis else (0.2,0.2,0.2,1)
+        volume = self.allocator.totals["volume"]
+        lines = [f"{len(engine):,} lines | {volume:,.2f} CBM"]
+        if self.allocator.unweighed and self.allocator.totals["weight"] > 0:
+            lines.append(f"Weight: {self.allocator.unweighed:,} lines have none, split by volume or value")
+        if basis is None:
+            lines.append(f"Per CBM rate: {engine.shipping_rate * volume:,.2f} DA freight")
+        else:
+            invoice = math.fsum(engine.allocation[0])
+            lines.append(f"Split {invoice:,.2f} DA by {basis}"
+                         + (f" in {elapsed:.1f} ms" if elapsed is not None else ""))
+            lines.append(f"Lines add up to {math.fsum(engine.freight):,.2f} DA "
+                         f"(per CBM rate: {engine.shipping_rate * volume:,.2f} DA)")
+        lines.append(f"Total: {int(engine.total_investment):,} DA")
+        self.lbl_status.text = "\n".join(lines)
+
+class HistoryScreen(Screen):
+    """ Past imports from the HistoryStore, each at the rates it was costed at and at
+    today's, all re-priced by one query. Tapping one opens its stored lines. """
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        layout = BoxLayout(orientation='vertical', padding=10, spacing=10)
+        layout.add_widget(Label(text="PAST IMPORTS", font_size='22sp', color=COLOR_ACCENT, size_hint_y=None, height=dp(40)))
+        self.lbl_status = Label(size_hint_y=None, height=dp(70), color=COLOR_SUBTEXT, halign='center')
+        layout.add_widget(self.lbl_status)
+
+        self.list = GridLayout(cols=1, spacing=5, size_hint_y=None)
+        self.list.bind(minimum_height=self.list.setter('height'))
+        scroll = ScrollView()
+        scroll.add_widget(self.list)
+        layout.add_widget(scroll)
+
+        buttons = BoxLayout(size_hint_y=None, height=dp(50), spacing=10)
+        for text, handler, color in (("<", self.back, (0.3,0.3,0.3,1)), ("EXPORT CSV", self.export, (0.1,0.3,0.5,1))):
+            btn = Button(text=text, background_color=color, bold=True)
+            btn.bind(on_press=handler)
+            buttons.add_widget(btn)
+        layout.add_widget(buttons)
+        self.add_widget(layout)
+        self.rows = []
+
+    def back(self, i): self.manager.current = 'home'
+
+    def on_pre_enter(self, *args):
+        self.refresh()
+
+    def refresh(self):
+        ex, sh = GLOBAL_SETTINGS["exchange_rate"], GLOBAL_SETTINGS["shipping_rate"]
+        started = time.perf_counter()
+        self.rows = HISTORY.store.reprice(ex, sh) if HISTORY.store else []
+        elapsed = (time.perf_counter() - started) * 1000
+        then = sum(row["total_investment"] for row in self.rows)
+        today = sum(row["repriced"] for row in self.rows)
+        rates = HISTORY.store.rate_history(2) if HISTORY.store else []
+        status = [f"{len(self.rows)} imports re-priced at {ex:g} / {sh:,.0f} in {elapsed:.1f} ms",
+                  f"As costed: {int(then):,} DA | Today: {int(today):,} DA"]
+        if len(rates) > 1:
+            status.append(f"Previous rates: {rates[1][1]:g} / {rates[1][2]:,.0f} until {time.strftime('%Y-%m-%d', time.localtime(rates[0][0]))}")
+        self.lbl_status.text = "\n".join(status)
+
+        self.list.clear_widgets()
+        for row in self.rows:
+            change = row["repriced"] - row["total_investment"]
+            color = "ff7f66" if change > 0 else "00cc66"
+            text = (f"[b]{escape_markup(row['name'])}[/b]  {time.strftime('%Y-%m-%d', time.localtime(row['updated_at']))}"
+                    f"  {row['line_count']:,} lines{'  freight split' if row['allocated'] else ''}\n"
+                    f"{int(row['total_investment']):,} DA at {row['exchange_rate']:g} / {row['shipping_rate']:,.0f}"
+                    f"  ->  [color={color}]{int(row['repriced']):,} DA ({change:+,.0f})[/color]")
+            btn = Button(text=text, markup=True, size_hint_y=None, height=dp(64), halign='left', valign='middle',
+                         background_color=COLOR_CARD_BG, disabled=not row["lines_kept"])
+            btn.bind(size=btn.setter('text_size'), on_press=lambda i, import_id=row["id"]: self.open_import(import_id))
+            self.list.add_widget(btn)
+
+    def open_import(self, import_id):
+        results, meta = open_past_import(HISTORY.store, import_id)
+        if results is None:
+            message_popup("Error", str(meta))
+            return
+        screen = self.manager.get_screen('results')
+        if screen.job: screen.cancel_import(None)
+        screen.stop_watch()
+        SESSION_STATE.update(meta)
+        SESSION_STATE["data"] = results
+        self.manager.current = 'results'
+        screen.load_data()
+
+    def export(self, instance):
+        if not self.rows: return
+        try:
+            path = export_output_path("CostHistory", "csv")
+            write_history_csv(self.rows, path, GLOBAL_SETTINGS["exchange_rate"], GLOBAL_SETTINGS["shipping_rate"])
+            message_popup("Success", f"Saved:\n{path}", (0.7,0.4))
+        except Exception as e:
+            message_popup("Error", str(e))
 
 class SettingsScreen(Screen):
     def __init__(self, **kwargs):
@@ -557,18 +1376,34 @@ class SettingsScreen(Screen):
         try:
             GLOBAL_SETTINGS["exchange_rate"] = float(self.inputs["exchange_rate"].text)
             GLOBAL_SETTINGS["shipping_rate"] = float(self.inputs["shipping_rate"].text)
+            HISTORY.record_rates()
+            # Loaded results follow the new rates straight away, no re-import
+            if reprice_session():
+                self.manager.get_screen('results').load_data()
             self.manager.current = 'home'
         except: pass
 
 class ImportApp(App):
     def build(self):
         Window.clearcolor = COLOR_BG
-        sm = ScreenManager()
+        TRACER.log_path = os.path.join(self.user_data_dir, TRACE_LOG_NAME)
+        FILES.open(self.user_data_dir)
+        HISTORY.open(self.user_data_dir)
+        sm = LazyScreenManager()
         sm.add_widget(HomeScreen(name='home'))
-        sm.add_widget(SettingsScreen(name='settings'))
-        sm.add_widget(ResultsScreen(name='results'))
+        sm.factories.update(settings=SettingsScreen, results=ResultsScreen, scenarios=ScenarioScreen, freight=FreightScreen,
+                            history=HistoryScreen)
+        Window.bind(on_flip=self.first_frame)
         Clock.schedule_once(lambda dt: request_android_permissions(), 1)
+        # Warm the file index so the picker opens on a current list
+        Clock.schedule_once(FILES.scan, 2)
         return sm
 
+    def first_frame(self, *args):
+        Window.unbind(on_flip=self.first_frame)
+        startup = time.perf_counter() - STARTED
+        TRACER.record("startup", "first_frame", startup)
+        print(f"Startup: {startup * 1000:.0f} ms to first frame")
+
 if __name__ == '__main__':
     ImportApp().run()
@@ -0,0 +1,56 @@
+import os
+import sys
+import math
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from engine import parse_workbook, FreightAllocator
+
+openpyxl = pytest.importorskip("openpyxl")
+
+HEADERS = ["NO", "ITEM", "Price(RMB)", "Ctn", "Qty", "CBM"]
+
+def make_workbook(path, sheets):
+    """ sheets: {title: (headers, rows)} """
+    wb = openpyxl.Workbook()
+    wb.remove(wb.active)
+    for title, (headers, rows) in sheets.items():
+        sheet = wb.create_sheet(title)
+        sheet.append(headers)
+        for row in rows:
+            sheet.append(row)
+    wb.save(path)
+    return path
+
+def test_weight_needs_every_line_weighed(tmp_path):
+    # One sheet with G.W, one without: its lines would silently get no freight
+    path = make_workbook(str(tmp_path / "mixed.xlsx"), {
+        "Weighed": (HEADERS + ["G.W"], [[1, "Chair", 10, 2, 6, 0.1, 12.5], [2, "Table", 20, 1, 1, 0.3, 30]]),
+        "No weight": (HEADERS, [[1, "Lamp", 5, 4, 12, 0.05]]),
+    })
+    results, meta = parse_workbook(path)
+    assert len(results) == 3
+    allocator = FreightAllocator(results.engine)
+    assert allocator.unweighed == 1
+    assert allocator.available() == ["volume", "value"]
+    with pytest.raises(ValueError, match="1 of 3 lines have no weight"):
+        allocator.allocate([100000], "weight")
+
+def test_blank_weight_cell(tmp_path):
+    path = make_workbook(str(tmp_path / "blank.xlsx"), {
+        "Sheet": (HEADERS + ["G.W"], [[1, "Chair", 10, 2, 6, 0.1, 12.5], [2, "Table", 20, 1, 1, 0.3, None]]),
+    })
+    results, _ = parse_workbook(path)
+    assert "weight" not in FreightAllocator(results.engine).available()
+
+def test_weight_split_reconciles(tmp_path):
+    path = make_workbook(str(tmp_path / "weighed.xlsx"), {
+        "Sheet": (HEADERS + ["G.W"], [[n, f"Item {n}", 1 + n, 1 + n % 3, 6, 0.1, 3 + n] for n in range(1, 30)]),
+    })
+    results, _ = parse_workbook(path)
+    allocator = FreightAllocator(results.engine)
+    assert "weight" in allocator.available()
+    freight = allocator.allocate([1850000, 45000, 12500.55], "weight")
+    assert sum(round(f * 100) for f in freight) == 190750055
+    assert math.isclose(math.fsum(freight), 1907500.55)
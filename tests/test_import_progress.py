@@ -0,0 +1,56 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from engine import parse_workbook, PROGRESS_EVERY
+
+openpyxl = pytest.importorskip("openpyxl")
+
+HEADERS = ["NO", "ITEM", "Price(RMB)", "Ctn", "Qty", "CBM"]
+
+def make_workbook(path, sheets):
+    """ sheets: {title: row count} """
+    wb = openpyxl.Workbook()
+    wb.remove(wb.active)
+    for title, count in sheets.items():
+        sheet = wb.create_sheet(title)
+        sheet.append(HEADERS)
+        for n in range(1, count + 1):
+            sheet.append([n, f"{title} {n}", 1 + n % 7, 1 + n % 3, 6, 0.1])
+    wb.save(path)
+    return path
+
+def record_progress(path):
+    """ Returns the final results and, per progress call, (rows, store, rows ready in it, their names). """
+    calls = []
+    def progress(phase, rows, images, results):
+        count = len(results) if results is not None else 0
+        names = [results.name(i) for i in range(count)] if results is not None else []
+        calls.append((rows, results, count, names))
+    results, _ = parse_workbook(path, progress=progress)
+    return results, calls
+
+def test_single_sheet_progress_fills_the_store(tmp_path):
+    rows = PROGRESS_EVERY * 2 + 10
+    results, calls = record_progress(make_workbook(str(tmp_path / "one.xlsx"), {"Sheet": rows}))
+    assert len(results) == rows
+    assert calls and all(store is results for _, store, _, _ in calls)
+    counts = [count for _, _, count, _ in calls]
+    assert counts == sorted(counts) and counts[0] > 0 and counts[-1] == rows
+
+def test_several_sheets_show_finished_rows(tmp_path):
+    sheets = {"First": PROGRESS_EVERY + 20, "Second": 30, "Third": PROGRESS_EVERY // 2}
+    results, calls = record_progress(make_workbook(str(tmp_path / "many.xlsx"), sheets))
+    assert len(results) == sum(sheets.values())
+    assert results.sheets == list(sheets)
+    # Every report carries the merged store, which only ever grows, in workbook order
+    assert all(store is results for _, store, _, _ in calls)
+    counts = [count for _, _, count, _ in calls]
+    assert counts == sorted(counts) and counts[-1] == len(results)
+    expected = [f"{title} {n}" for title, count in sheets.items() for n in range(1, count + 1)]
+    for _, _, count, names in calls:
+        assert names == expected[:count]
+    # Rows were shown before the last sheet joined
+    assert any(0 < count < len(results) for count in counts)